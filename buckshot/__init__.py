@@ -1,6 +1,7 @@
 import logging
 
 from buckshot.version import __version__
+from buckshot.workers import get_context
 from buckshot.contexts import distributed
 from buckshot.decorators import distribute
 
@@ -1,29 +1,50 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import os
+import mmap
+import time
+import uuid
+import zlib
+import heapq
+import struct
+import sqlite3
+import hashlib
+import marshal
 import logging
 import functools
+import threading
+import contextlib
+import collections
+import cPickle as pickle
 import multiprocessing
-
-from buckshot import lockutils
+import multiprocessing.util
+import multiprocessing.managers
 
 LOG = logging.getLogger(__name__)
 DEFAULT_LRU_CACHE_SIZE = 256
+DEFAULT_L1_CACHE_SIZE = 64
+DEFAULT_CACHE_SHARDS = 16
+DEFAULT_SHM_CACHE_SLOTS = 4096
+DEFAULT_SHM_SLOT_SIZE = 1024  # bytes
+DEFAULT_SHM_CACHE_WAYS = 8  # slots per bucket
+DEFAULT_SHM_CACHE_STRIPES = 64  # locks
+DEFAULT_DISK_CACHE_BYTES = 256 * 1024 * 1024
+DISK_CACHE_ATIME_RESOLUTION = 60  # seconds between access time updates
+DUMP_BATCH_SIZE = 1000  # items per pickle in dump files
+DUMP_FORMAT_VERSION = 1
 
 
-class LRUCache(object):
-    """A multiprocess LRU cache."""
+class BaseCache(object):
+    """Base class for caches which can be passed to memoize().
 
-    def __init__(self, size=DEFAULT_LRU_CACHE_SIZE):
-        if not size:
-            raise ValueError("LRUCache size must be > 0")
+    Subclasses implement get() and put(). Caches which can look up or
+    store several items more cheaply than one at a time override
+    get_many() and put_many(). Caches which support dump() and load()
+    implement _dump_items().
+    """
 
-        self._size = 0
-        self._max_size = size
-        self._manager = multiprocessing.Manager()
-        self._order = self._manager.list()
-        self._storage = self._manager.dict()
-        self._lock = multiprocessing.Lock()
+    ttl = None  # The default number of seconds an item lives in the cache.
 
     def __getitem__(self, key):
         return self.get(key)
@@ -31,45 +52,1491 @@ class LRUCache(object):
     def __setitem__(self, key, value):
         self.put(key, value)
 
-    @lockutils.with_lock("_lock")
+    def get(self, key):
+        raise NotImplementedError()
+
+    def put(self, key, value):
+        raise NotImplementedError()
+
+    def get_many(self, keys):
+        """Return a dict of the items found for the input `keys`. Missing
+        keys are left out of the result.
+        """
+        found = {}
+
+        for key in keys:
+            try:
+                found[key] = self.get(key)
+            except KeyError:
+                pass
+        return found
+
+    def put_many(self, items):
+        """Insert each ``(key, value)`` pair in `items`."""
+        for key, value in items:
+            self.put(key, value)
+
+    def _dump_items(self):
+        """Yield a ``(key, value, expires)`` tuple for each item, least
+        recently used first. `expires` is a time.time() value or None.
+        """
+        raise NotImplementedError()
+
+    def _load_items(self, items):
+        """Insert ``(key, value, expires)`` tuples read by load()."""
+        self.put_many((key, value) for key, value, _ in items)
+
+    def dump(self, path):
+        """Write the cache contents and recency order to the file at `path`.
+
+        The file is a stream of small pickles, each holding a batch of
+        items, so neither dump() nor load() has to hold a serialized copy
+        of the whole cache in memory. The file is written to a temporary
+        path and renamed, so an existing snapshot is only replaced by a
+        complete one.
+        """
+        tmp = path + ".tmp"
+
+        with open(tmp, "wb") as f:
+            pickle.dump({"version": DUMP_FORMAT_VERSION}, f, pickle.HIGHEST_PROTOCOL)
+
+            batch = []
+            for item in self._dump_items():
+                batch.append(item)
+                if len(batch) == DUMP_BATCH_SIZE:
+                    pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+                    batch = []
+
+            if batch:
+                pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+
+        os.rename(tmp, path)
+
+    def load(self, path):
+        """Insert the items from a file written by dump(). Items are
+        inserted least recently used first, so the recency order is
+        restored. Items which expired since the dump are skipped.
+        """
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+
+            if header.get("version") != DUMP_FORMAT_VERSION:
+                raise ValueError("Unsupported cache dump version: %r" % header.get("version"))
+
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    break
+                self._load_items(batch)
+
+
+class CacheStats(object):
+    """Hit, miss, insert, eviction and expiration counters plus a histogram
+    of lookup latencies for a cache.
+
+    Latencies are counted in power-of-two microsecond buckets. Bucket ``i``
+    holds lookups which took less than ``2 ** i`` microseconds (and at
+    least ``2 ** (i - 1)``). The last bucket is unbounded.
+    """
+
+    COUNTERS = ("hits", "misses", "inserts", "evictions", "expirations")
+    LATENCY_BUCKETS = 24
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.latency = [0] * self.LATENCY_BUCKETS
+
+    @classmethod
+    def latency_bucket(cls, seconds):
+        """Return the histogram bucket index for a latency in seconds."""
+        micros = int(seconds * 1e6)
+        return min(micros.bit_length(), cls.LATENCY_BUCKETS - 1)
+
+    @classmethod
+    def latency_bound(cls, index):
+        """Return the upper bound, in seconds, of the bucket at `index`."""
+        if index == cls.LATENCY_BUCKETS - 1:
+            return float("inf")
+        return (2 ** index) / 1e6
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def record_latency(self, seconds):
+        self.latency[self.latency_bucket(seconds)] += 1
+
+    def as_dict(self, size):
+        """Return the stats as a dict. The ``latency`` item is a list of
+        ``(upper bound in seconds, count)`` tuples for non-empty buckets.
+        """
+        stats = dict(self.counters)
+        stats["size"] = size
+        stats["latency"] = [
+            (self.latency_bound(index), count)
+            for index, count in enumerate(self.latency) if count
+        ]
+        return stats
+
+
+def merge_stats(stats):
+    """Combine an iterable of stats() dicts into one dict."""
+    merged = collections.Counter()
+    latency = collections.Counter()
+
+    for item in stats:
+        for name, value in item.iteritems():
+            if name != "latency":
+                merged[name] += value
+        for bound, count in item["latency"]:
+            latency[bound] += count
+
+    merged = dict(merged)
+    merged["latency"] = sorted(latency.items())
+    return merged
+
+
+class LRUStore(object):
+    """LRU storage which lives inside a CacheManager server process. It is
+    also used directly as a process-local cache by TieredCache.
+
+    Items are kept in an OrderedDict (a hash table plus a doubly linked
+    list), so lookups, recency updates and evictions are all O(1). The
+    least recently used item is at the front of the OrderedDict.
+
+    The store can be bounded by item count, by the approximate total size
+    of its values in bytes, or both. Items can also have a time-to-live.
+    Expired items are dropped when they are looked up, and the items which
+    expire soonest are tracked in a heap so they can be purged on put()
+    without scanning the whole store.
+
+    The manager server handles each client connection in its own thread,
+    so every operation is guarded by a lock.
+
+    Lookup latency is measured by the client. To avoid an extra round trip,
+    the client passes the latency of its previous lookup along with the
+    next get().
+
+    Args:
+        size: The maximum number of items.
+        max_bytes: The maximum total size of the values, as reported by
+            the client in put(). If None, size in bytes is not bounded.
+        ttl: The default number of seconds an item lives. If None, items
+            do not expire.
+    """
+
+    def __init__(self, size=DEFAULT_LRU_CACHE_SIZE, max_bytes=None, ttl=None):
+        self._max_size = size
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._items = collections.OrderedDict()  # key => (value, nbytes, expires)
+        self._expiry = []  # heap of (expires, key)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    def __len__(self):
+        return len(self._items)
+
     def keys(self):
-        return list(self._order)
+        """Return the cache keys, most recently used first."""
+        with self._lock:
+            return list(reversed(self._items))
 
-    @lockutils.with_lock("_lock")
     def values(self):
-        return self._storage.values()
+        """Return the cache values, most recently used first."""
+        with self._lock:
+            return [item[0] for item in reversed(self._items.values())]
+
+    def stats(self):
+        with self._lock:
+            stats = self._stats.as_dict(len(self._items))
+            stats["bytes"] = self._bytes
+            return stats
+
+    def _remove(self, key):
+        _, nbytes, _ = self._items.pop(key)
+        self._bytes -= nbytes
+
+    def _purge_expired(self, now):
+        """Remove items whose time-to-live has passed."""
+        expiry, items = self._expiry, self._items
+
+        while expiry and expiry[0][0] <= now:
+            expires, key = heapq.heappop(expiry)
+            item = items.get(key)
+
+            # The heap entry is stale if the key was removed or re-put.
+            if item is not None and item[2] == expires:
+                self._remove(key)
+                self._stats.count("expirations")
+
+        # Drop stale heap entries if they start to outnumber live ones.
+        if len(expiry) > 2 * len(items) + 64:
+            self._expiry = [(item[2], key) for key, item in items.iteritems() if item[2] is not None]
+            heapq.heapify(self._expiry)
+
+    def _get(self, key, now):
+        """Return the value for `key`. The lock must be held."""
+        try:
+            item = self._items.pop(key)
+        except KeyError:
+            self._stats.count("misses")
+            raise
+
+        expires = item[2]
+        if expires is not None and expires <= now:
+            self._bytes -= item[1]
+            self._stats.count("expirations")
+            self._stats.count("misses")
+            raise KeyError(key)
+
+        self._stats.count("hits")
+        self._items[key] = item
+        return item[0]
+
+    def get(self, key, latency=None):
+        with self._lock:
+            if latency is not None:
+                self._stats.record_latency(latency)
+            return self._get(key, time.time())
+
+    def get_many(self, keys, latency=None):
+        """Return a dict of the items found for the input `keys`. Missing
+        keys are left out of the result.
+        """
+        with self._lock:
+            if latency is not None:
+                self._stats.record_latency(latency)
+
+            now, found = time.time(), {}
+
+            for key in keys:
+                try:
+                    found[key] = self._get(key, now)
+                except KeyError:
+                    pass
+            return found
+
+    def _put(self, key, value, nbytes, ttl, now):
+        """Insert an item without evicting. The lock must be held."""
+        if ttl is None:
+            ttl = self._ttl
+
+        # Drop the old value first, so an oversized put doesn't leave it.
+        if key in self._items:
+            self._remove(key)
+
+        if self._max_bytes is not None and nbytes > self._max_bytes:
+            LOG.debug("Item too large for cache: %d bytes", nbytes)
+            return
+
+        expires = None if ttl is None else now + ttl
+        self._items[key] = (value, nbytes, expires)
+        self._bytes += nbytes
+        self._stats.count("inserts")
+
+        if expires is not None:
+            heapq.heappush(self._expiry, (expires, key))
+
+    def _evict(self, now):
+        """Remove expired items, then the least recently used items until
+        the store is within its bounds. The lock must be held.
+        """
+        self._purge_expired(now)
+
+        while (len(self._items) > self._max_size or
+               self._max_bytes is not None and self._bytes > self._max_bytes):
+            _, item = self._items.popitem(last=False)
+            self._bytes -= item[1]
+            self._stats.count("evictions")
+
+    def put(self, key, value, nbytes=0, ttl=None):
+        """Insert `value` under `key`.
+
+        Args:
+            key: The cache key.
+            value: The value to cache.
+            nbytes: The size of the value in bytes.
+            ttl: Number of seconds the item lives. Defaults to the store ttl.
+        """
+        with self._lock:
+            now = time.time()
+            self._put(key, value, nbytes, ttl, now)
+            self._evict(now)
+
+    def put_many(self, items):
+        """Insert each ``(key, value, nbytes, ttl)`` tuple in `items`. See
+        put().
+        """
+        with self._lock:
+            now = time.time()
+
+            for key, value, nbytes, ttl in items:
+                self._put(key, value, nbytes, ttl, now)
+            self._evict(now)
+
+    def peek_many(self, keys):
+        """Return a ``(key, value, expires)`` tuple for each unexpired key
+        in `keys` that is in the store. This does not change the recency
+        order or the stats.
+        """
+        with self._lock:
+            now, items, found = time.time(), self._items, []
+
+            for key in keys:
+                item = items.get(key)
+
+                if item is None or item[2] is not None and item[2] <= now:
+                    continue
+                found.append((key, item[0], item[2]))
+            return found
+
+
+# Named LRUStore objects. This is only populated in CacheManager servers.
+_named_stores = {}
+_named_stores_lock = threading.Lock()
+
+
+def _named_lru_store(name, size, max_bytes=None, ttl=None):
+    """Return the LRUStore registered under `name`, creating it with the
+    input arguments if it does not exist yet. Executed in the server
+    process.
+    """
+    with _named_stores_lock:
+        try:
+            return _named_stores[name]
+        except KeyError:
+            store = _named_stores[name] = LRUStore(size, max_bytes, ttl)
+            return store
+
+
+class _StoreRegistry(object):
+    """Removes named LRUStore objects from a CacheManager server. Executed
+    in the server process.
+    """
+
+    def drop(self, names):
+        """Forget the stores registered under `names`. Each store is freed
+        once no client holds a proxy for it.
+        """
+        with _named_stores_lock:
+            for name in names:
+                _named_stores.pop(name, None)
+
+
+class CacheManager(multiprocessing.managers.BaseManager):
+    """Manager whose server process hosts cache storage objects."""
+    pass
+
+
+CacheManager.register(
+    str("LRUStore"),  # typeid must be a native str
+    _named_lru_store,
+    exposed=("__len__", "keys", "values", "get", "get_many", "put",
+             "put_many", "peek_many", "stats")
+)
+
+CacheManager.register(str("StoreRegistry"), _StoreRegistry, exposed=("drop",))
+
+
+# The CacheManager shared by every cache in this program.
+_service = None
+_service_lock = threading.Lock()
+_service_needed = False
+
+
+def get_service():
+    """Return the shared CacheManager, starting it on first use."""
+    global _service
+
+    with _service_lock:
+        if _service is None:
+            LOG.debug("Starting cache service.")
+            _service = CacheManager()
+            _service.start()
+        return _service
+
+
+def before_fork():
+    """Start the cache service if any cache has been created, so worker
+    processes forked afterwards share it with the parent.
+
+    This is called by ProcessPoolDistributor before it starts its workers.
+    """
+    if _service_needed:
+        get_service()
+
+
+def _unique_name():
+    return uuid.uuid4().hex
+
+
+def _drop_stores(names):
+    """Remove the named stores from the cache service, if it is running."""
+    if _service is not None:
+        _service.StoreRegistry().drop(names)
+
+
+def _release_stores(names, pid):
+    """Drop the stores of a cache with a generated name when it is garbage
+    collected in the process which created it. Nothing else can refer to
+    the stores by name.
+    """
+    if os.getpid() != pid:
+        return
+
+    try:
+        _drop_stores(names)
+    except Exception as ex:  # E.g., the service has already shut down.
+        LOG.debug("Could not release cache stores: %s", ex)
+
+
+class LRUCache(BaseCache):
+    """A multiprocess LRU cache.
+
+    The cache contents and recency order live in the cache service (a
+    CacheManager server process shared by all caches in the program), so
+    each get() or put() is a single IPC round trip regardless of the cache
+    size. The service is started on first use rather than when the cache is
+    created.
+
+    Hit, miss, insert and eviction counts and lookup latencies are kept by
+    the service, so stats() reports activity from every process using the
+    cache.
+
+    If `max_bytes` is set, each value is pickled on put() to measure its
+    size and the least recently used items are evicted to keep the total
+    under `max_bytes`.
+
+    The storage stays in the service until close() is called. For a cache
+    with a generated name, that also happens when the cache is garbage
+    collected in the process which created it.
+
+    Args:
+        size: The maximum number of items in the cache.
+        name: Caches created with the same name share the same storage.
+            If None, a unique name is generated.
+        max_bytes: The maximum total size of the cached values in bytes,
+            measured from their pickled form. If None, only the item count
+            is bounded.
+        ttl: The default number of seconds an item lives in the cache. If
+            None, items do not expire.
+    """
+
+    def __init__(self, size=DEFAULT_LRU_CACHE_SIZE, name=None, max_bytes=None,
+                 ttl=None):
+        global _service_needed
+
+        if not size:
+            raise ValueError("LRUCache size must be > 0")
+
+        _service_needed = True
+        self._max_size = size
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._name = name or _unique_name()
+        self._proxy = None
+        self._latency = None  # Latency of the last lookup, sent with the next.
+
+        if name is None:
+            multiprocessing.util.Finalize(
+                self, _release_stores, args=([self._name], os.getpid())
+            )
+
+    @property
+    def _store(self):
+        if self._proxy is None:
+            self._proxy = get_service().LRUStore(
+                self._name, self._max_size, self._max_bytes, self._ttl
+            )
+        return self._proxy
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def __len__(self):
+        return len(self._store)
+
+    def close(self):
+        """Free the cache's storage in the cache service. The cache, and
+        any other cache with the same name, is empty afterwards.
+        """
+        self._proxy = None
+        _drop_stores([self._name])
+
+    def keys(self):
+        return self._store.keys()
+
+    def values(self):
+        return self._store.values()
+
+    def stats(self):
+        """Return a dict of hits, misses, inserts, evictions, expirations,
+        the current size (in items and bytes) and a lookup latency
+        histogram. See CacheStats.
+        """
+        return self._store.stats()
 
-    @lockutils.with_lock("_lock")
     def get(self, key):
-        value = self._storage[key]
-        self._order.remove(key)  # This sucks and is O(n). Make me faster!
-        self._order.insert(0, key)
-        return value
+        latency, self._latency = self._latency, None
+        start = time.time()
 
-    @lockutils.with_lock("_lock")
-    def put(self, key, item):
-        self._storage[key] = item
+        try:
+            return self._store.get(key, latency)
+        finally:
+            self._latency = time.time() - start
+
+    def get_many(self, keys):
+        """Look up every key in `keys` in a single round trip. Returns a
+        dict of the items found.
+        """
+        latency, self._latency = self._latency, None
+        start = time.time()
 
         try:
-            self._order.remove(key)
-        except ValueError:
-            pass
+            return self._store.get_many(list(keys), latency)
+        finally:
+            self._latency = time.time() - start
+
+    def put(self, key, item, ttl=None):
+        """Insert `item` under `key`. If `ttl` is provided, it overrides the
+        cache's default time-to-live for this item.
+        """
+        self._store.put(key, item, _nbytes(item, self._max_bytes), ttl)
+
+    def put_many(self, items, ttl=None):
+        """Insert each ``(key, value)`` pair in `items` in a single round
+        trip. See put().
+        """
+        max_bytes = self._max_bytes
+        items = [(key, value, _nbytes(value, max_bytes), ttl) for key, value in items]
+        self._store.put_many(items)
+
+    def _dump_items(self):
+        return _dump_store(self._store)
+
+    def _load_items(self, items):
+        self._store.put_many(_load_records(items, self._max_bytes))
+
+
+def _nbytes(value, max_bytes):
+    """Return the pickled size of `value`, or 0 if the cache it is being
+    put into is not bounded by bytes.
+    """
+    if max_bytes is None:
+        return 0
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+def _dump_store(store):
+    """Yield ``(key, value, expires)`` tuples from an LRUStore proxy, least
+    recently used first. The keys are read in one round trip and the values
+    are read in batches, so the store is never serialized all at once.
+    """
+    keys = store.keys()
+    keys.reverse()
+
+    for index in xrange(0, len(keys), DUMP_BATCH_SIZE):
+        for item in store.peek_many(keys[index:index + DUMP_BATCH_SIZE]):
+            yield item
+
+
+def _load_records(items, max_bytes):
+    """Convert ``(key, value, expires)`` tuples into the ``(key, value,
+    nbytes, ttl)`` tuples LRUStore.put_many() expects. Expired items are
+    dropped.
+    """
+    now, records = time.time(), []
+
+    for key, value, expires in items:
+        ttl = None if expires is None else expires - now
+
+        if ttl is None or ttl > 0:
+            records.append((key, value, _nbytes(value, max_bytes), ttl))
+    return records
+
+
+class ShardedLRUCache(BaseCache):
+    """A multiprocess LRU cache split into independent shards.
+
+    Each key is hashed to one of `shards` LRUStore objects. Every shard has
+    its own lock and its own recency order, so concurrent workers only
+    contend when they touch keys in the same shard. Eviction is per shard,
+    which approximates a global LRU policy.
+
+    A single server process can only execute one request at a time (it is
+    bound by the GIL), so shards can be spread across several servers to
+    serve lookups in parallel. With one server, the shards live in the
+    shared cache service and are created on first use. Additional servers
+    are dedicated to this cache and started immediately.
+
+    Shards in the shared service are kept until close() is called, or the
+    cache is garbage collected if its name was generated. See LRUCache.
+    Dedicated servers are stopped by close(), after which the cache can't
+    be used, or when the cache is garbage collected.
+
+    Args:
+        size: The total number of items the cache can hold. This is divided
+            evenly between the shards.
+        shards: The number of shards.
+        servers: The number of server processes the shards are spread across.
+        name: Caches created with the same name share the same storage.
+            If None, a unique name is generated.
+        max_bytes: The maximum total size of the cached values in bytes.
+            This is divided evenly between the shards. See LRUCache.
+        ttl: The default number of seconds an item lives in the cache.
+    """
+
+    def __init__(self, size=DEFAULT_LRU_CACHE_SIZE, shards=DEFAULT_CACHE_SHARDS,
+                 servers=1, name=None, max_bytes=None, ttl=None):
+        global _service_needed
+
+        if not size:
+            raise ValueError("ShardedLRUCache size must be > 0")
+        if not shards:
+            raise ValueError("ShardedLRUCache shards must be > 0")
+        if not 0 < servers <= shards:
+            raise ValueError("ShardedLRUCache servers must be between 1 and shards")
+
+        self._max_size = size
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._name = name or _unique_name()
+        self._num_shards = shards
+        self._proxies = None
+        self._latency = None  # Latency of the last lookup, sent with the next.
+
+        if servers == 1:
+            _service_needed = True
+            self._managers = None
+
+            if name is None:
+                multiprocessing.util.Finalize(
+                    self, _release_stores, args=(self._shard_names(), os.getpid())
+                )
+        else:
+            self._managers = [CacheManager() for _ in xrange(servers)]
+
+            for manager in self._managers:
+                manager.start()
+
+    @property
+    def _shards(self):
+        if self._proxies is None:
+            managers = self._managers or [get_service()]
+            shard_size = -(-self._max_size // self._num_shards)  # Round up so no shard is empty.
+            shard_bytes = None
+
+            if self._max_bytes is not None:
+                shard_bytes = self._max_bytes // self._num_shards
+
+            self._proxies = [
+                managers[index % len(managers)].LRUStore(
+                    shard_name, shard_size, shard_bytes, self._ttl
+                )
+                for index, shard_name in enumerate(self._shard_names())
+            ]
+        return self._proxies
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def _shard_names(self):
+        return ["%s:%d" % (self._name, index) for index in xrange(self._num_shards)]
+
+    def close(self):
+        """Free the storage of every shard. See LRUCache.close()."""
+        self._proxies = None
+
+        if self._managers is None:
+            _drop_stores(self._shard_names())
+            return
+
+        for manager in self._managers:
+            manager.shutdown()
+
+    def _shard(self, key):
+        shards = self._shards
+        return shards[hash(key) % len(shards)]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def keys(self):
+        return [key for shard in self._shards for key in shard.keys()]
+
+    def values(self):
+        return [value for shard in self._shards for value in shard.values()]
+
+    def stats(self):
+        """Return the combined stats of every shard. See LRUCache.stats()."""
+        return merge_stats(shard.stats() for shard in self._shards)
+
+    def get(self, key):
+        latency, self._latency = self._latency, None
+        start = time.time()
+
+        try:
+            return self._shard(key).get(key, latency)
+        finally:
+            self._latency = time.time() - start
+
+    def _group(self, items, key=lambda item: item):
+        """Group `items` by the index of the shard their key maps to."""
+        groups = collections.defaultdict(list)
+        count = self._num_shards
+
+        for item in items:
+            groups[hash(key(item)) % count].append(item)
+        return groups
+
+    def get_many(self, keys):
+        """Look up every key in `keys` with one round trip per shard.
+        Returns a dict of the items found.
+        """
+        latency, self._latency = self._latency, None
+        start = time.time()
+        shards, found = self._shards, {}
+
+        try:
+            for index, group in self._group(keys).iteritems():
+                found.update(shards[index].get_many(group, latency))
+                latency = None
+            return found
         finally:
-            self._order.insert(0, key)
-            self._size += 1
+            self._latency = time.time() - start
+
+    def put(self, key, item, ttl=None):
+        """Insert `item` under `key`. See LRUCache.put()."""
+        self._shard(key).put(key, item, _nbytes(item, self._max_bytes), ttl)
+
+    def put_many(self, items, ttl=None):
+        """Insert each ``(key, value)`` pair in `items` with one round trip
+        per shard. See LRUCache.put().
+        """
+        max_bytes, shards = self._max_bytes, self._shards
+        items = ((key, value, _nbytes(value, max_bytes), ttl) for key, value in items)
+
+        for index, group in self._group(items, key=lambda item: item[0]).iteritems():
+            shards[index].put_many(group)
+
+    def _dump_items(self):
+        """Yield the items of each shard in turn. Recency order is kept
+        within each shard, which is all that eviction depends on.
+        """
+        for shard in self._shards:
+            for item in _dump_store(shard):
+                yield item
+
+    def _load_items(self, items):
+        records = _load_records(items, self._max_bytes)
+        shards = self._shards
+
+        for index, group in self._group(records, key=lambda item: item[0]).iteritems():
+            shards[index].put_many(group)
+
+
+class SharedMemoryCache(BaseCache):
+    """A multiprocess cache stored in a shared, anonymous memory map.
+
+    The memory map is inherited by worker processes forked after the cache
+    is created, so lookups read shared memory directly instead of making a
+    round trip to a server process.
+
+    The table is a set-associative hash table: each key hashes to a bucket
+    of `ways` fixed-size slots. When a bucket is full, the least recently
+    used slot in the bucket is evicted. Each bucket is guarded by one of
+    `stripes` locks.
+
+    Keys and values are pickled. Items which do not fit in a single slot
+    are not cached.
+
+    Stats counters and the lookup latency histogram are kept per lock
+    stripe in the shared memory map, so they include every process.
+
+    Args:
+        slots: Total number of slots in the table.
+        slot_size: Size of each slot in bytes, including a small header.
+        ways: Number of slots per bucket.
+        stripes: Number of locks guarding the buckets.
+    """
+
+    # state, key hash, key length, value length, last access time
+    _HEADER = struct.Struct(str("<BIIId"))
+    _EMPTY, _USED = 0, 1
+
+    # Per-stripe stats: counters, size, then the latency histogram buckets.
+    _STAT = struct.Struct(str("<Q"))
+    _STAT_NAMES = CacheStats.COUNTERS + ("size",)
+    _STAT_FIELDS = len(_STAT_NAMES) + CacheStats.LATENCY_BUCKETS
+
+    def __init__(self, slots=DEFAULT_SHM_CACHE_SLOTS, slot_size=DEFAULT_SHM_SLOT_SIZE,
+                 ways=DEFAULT_SHM_CACHE_WAYS, stripes=DEFAULT_SHM_CACHE_STRIPES):
+        if slots < ways:
+            raise ValueError("SharedMemoryCache slots must be >= ways")
+        if slot_size <= self._HEADER.size:
+            raise ValueError("SharedMemoryCache slot_size must be > %d" % self._HEADER.size)
+
+        self._ways = ways
+        self._slot_size = slot_size
+        self._num_buckets = slots // ways
+        self._stats_offset = self._num_buckets * ways * slot_size
+        self._mmap = mmap.mmap(-1, self._stats_offset + stripes * self._STAT_FIELDS * self._STAT.size)
+        self._locks = [multiprocessing.Lock() for _ in xrange(stripes)]
+
+    def __len__(self):
+        return sum(1 for _ in self._iter_slots())
+
+    def _hash(self, kbytes):
+        return zlib.crc32(kbytes) & 0xffffffff
+
+    def _bucket(self, khash):
+        """Return the lock stripe, lock and slot offsets for the bucket
+        `khash` maps to.
+        """
+        bucket = khash % self._num_buckets
+        stripe = bucket % len(self._locks)
+        start = bucket * self._ways * self._slot_size
+        offsets = xrange(start, start + self._ways * self._slot_size, self._slot_size)
+        return stripe, self._locks[stripe], offsets
+
+    def _stat_offset(self, stripe, field):
+        return self._stats_offset + (stripe * self._STAT_FIELDS + field) * self._STAT.size
+
+    def _count(self, stripe, field, amount=1):
+        """Increment a stats field. The stripe lock must be held."""
+        offset = self._stat_offset(stripe, field)
+        value, = self._STAT.unpack_from(self._mmap, offset)
+        self._STAT.pack_into(self._mmap, offset, value + amount)
+
+    def _count_latency(self, stripe, seconds):
+        field = len(self._STAT_NAMES) + CacheStats.latency_bucket(seconds)
+        self._count(stripe, field)
+
+    def stats(self):
+        """Return a dict of hits, misses, inserts, evictions, the current
+        size and a lookup latency histogram. See CacheStats.
+        """
+        stats, size = CacheStats(), 0
+        names = self._STAT_NAMES
+
+        for stripe, lock in enumerate(self._locks):
+            with lock:
+                fields = [
+                    self._STAT.unpack_from(self._mmap, self._stat_offset(stripe, field))[0]
+                    for field in xrange(self._STAT_FIELDS)
+                ]
+
+            for name, value in zip(names, fields):
+                if name == "size":
+                    size += value
+                else:
+                    stats.count(name, value)
+
+            for index, value in enumerate(fields[len(names):]):
+                stats.latency[index] += value
+
+        return stats.as_dict(size)
+
+    def _find(self, offsets, khash, kbytes):
+        """Return the offset of the slot holding `kbytes`, or None."""
+        header, data = self._HEADER, self._mmap
+
+        for offset in offsets:
+            state, slot_hash, klen, _, _ = header.unpack_from(data, offset)
+
+            if state != self._USED or slot_hash != khash or klen != len(kbytes):
+                continue
+
+            start = offset + header.size
+            if data[start:start + klen] == kbytes:
+                return offset
+        return None
+
+    def _victim(self, offsets):
+        """Return the offset of an empty slot, or the least recently used
+        slot if the bucket is full.
+        """
+        header, data = self._HEADER, self._mmap
+        oldest, victim = None, None
+
+        for offset in offsets:
+            state, _, _, _, atime = header.unpack_from(data, offset)
+
+            if state == self._EMPTY:
+                return offset
+            elif oldest is None or atime < oldest:
+                oldest, victim = atime, offset
+        return victim
+
+    def _iter_slots(self, atime=False):
+        """Yield (key bytes, value bytes) for every used slot. If `atime` is
+        True, yield (key bytes, value bytes, access time) instead.
+        """
+        header, data = self._HEADER, self._mmap
+
+        for bucket in xrange(self._num_buckets):
+            lock = self._locks[bucket % len(self._locks)]
+            start = bucket * self._ways * self._slot_size
+
+            with lock:
+                items = []
+                for offset in xrange(start, start + self._ways * self._slot_size, self._slot_size):
+                    state, _, klen, vlen, used = header.unpack_from(data, offset)
+                    if state != self._USED:
+                        continue
+                    kstart = offset + header.size
+                    item = (data[kstart:kstart + klen],
+                            data[kstart + klen:kstart + klen + vlen])
+                    items.append(item + (used,) if atime else item)
+
+            for item in items:
+                yield item
+
+    def keys(self):
+        return [pickle.loads(k) for k, _ in self._iter_slots()]
+
+    def values(self):
+        return [pickle.loads(v) for _, v in self._iter_slots()]
+
+    def _dump_items(self):
+        """Yield the items in access time order. Slots are collected and
+        sorted first since recency is only tracked within a bucket.
+        """
+        slots = sorted(self._iter_slots(atime=True), key=lambda slot: slot[2])
+
+        for kbytes, vbytes, _ in slots:
+            yield pickle.loads(kbytes), pickle.loads(vbytes), None
+
+    def get(self, key):
+        started = time.time()
+        kbytes = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+        khash = self._hash(kbytes)
+        stripe, lock, offsets = self._bucket(khash)
+        header, data = self._HEADER, self._mmap
+
+        with lock:
+            offset = self._find(offsets, khash, kbytes)
+            now = time.time()
+            self._count_latency(stripe, now - started)
+
+            if offset is None:
+                self._count(stripe, self._STAT_NAMES.index("misses"))
+                raise KeyError(key)
+
+            self._count(stripe, self._STAT_NAMES.index("hits"))
+            _, _, klen, vlen, _ = header.unpack_from(data, offset)
+            header.pack_into(data, offset, self._USED, khash, klen, vlen, now)
+            start = offset + header.size + klen
+            vbytes = data[start:start + vlen]
+
+        return pickle.loads(vbytes)
+
+    def put(self, key, value):
+        kbytes = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+        vbytes = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        khash = self._hash(kbytes)
+        stripe, lock, offsets = self._bucket(khash)
+        header, data = self._HEADER, self._mmap
+
+        with lock:
+            offset = self._find(offsets, khash, kbytes)
+
+            if header.size + len(kbytes) + len(vbytes) > self._slot_size:
+                LOG.debug("Item too large for SharedMemoryCache slot: %d bytes",
+                          len(kbytes) + len(vbytes))
+
+                # Clear the old value so it isn't served after this put.
+                if offset is not None:
+                    header.pack_into(data, offset, self._EMPTY, 0, 0, 0, 0.0)
+                    self._count(stripe, self._STAT_NAMES.index("size"), -1)
+                return
+
+            if offset is None:
+                offset = self._victim(offsets)
+
+                if header.unpack_from(data, offset)[0] == self._USED:
+                    self._count(stripe, self._STAT_NAMES.index("evictions"))
+                else:
+                    self._count(stripe, self._STAT_NAMES.index("size"))
+
+            self._count(stripe, self._STAT_NAMES.index("inserts"))
+            start = offset + header.size
+            data[start:start + len(kbytes) + len(vbytes)] = kbytes + vbytes
+            header.pack_into(data, offset, self._USED, khash, len(kbytes),
+                             len(vbytes), time.time())
+
+
+class DiskCache(BaseCache):
+    """A persistent cache stored in an SQLite database file.
+
+    Cached values survive process restarts, so results computed by one run
+    can be reused by the next. The database is opened in WAL mode, which
+    lets many processes read while one writes. Each process (and thread)
+    opens its own connection, so the cache can be shared with forked
+    ProcessPoolDistributor workers.
+
+    Keys and values are pickled. The total size of the pickled values is
+    kept under `max_bytes` by evicting the least recently used items.
+    Access times are only updated once every DISK_CACHE_ATIME_RESOLUTION
+    seconds per item so that reads rarely write to the database.
+
+    Args:
+        path: Path to the database file. It is created if necessary.
+        max_bytes: The maximum total size of the cached values in bytes.
+        timeout: Seconds to wait for another process's lock on the database.
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS cache ("
+        "  key BLOB PRIMARY KEY,"
+        "  value BLOB NOT NULL,"
+        "  size INTEGER NOT NULL,"
+        "  atime REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS cache_atime ON cache (atime)",
+        "CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY, bytes INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO meta (id, bytes) VALUES (0, 0)",
+    )
+
+    _BATCH_SIZE = 500  # Keys per query. SQLite limits query parameters.
+    _EVICT_BATCH_SIZE = 64
+
+    def __init__(self, path, max_bytes=DEFAULT_DISK_CACHE_BYTES, timeout=30):
+        self._path = path
+        self._max_bytes = max_bytes
+        self._timeout = timeout
+        self._local = threading.local()
+
+        with self._transaction() as conn:
+            for statement in self._SCHEMA:
+                conn.execute(statement)
+
+    @property
+    def _conn(self):
+        """Return a connection owned by the current process and thread.
+
+        Connections must not be shared across a fork, so the thread local
+        connection is replaced if it was created by another process.
+        """
+        local, pid = self._local, os.getpid()
+
+        if getattr(local, "pid", None) != pid:
+            conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            local.conn, local.pid = conn, pid
+        return local.conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _dumps(self, obj):
+        return sqlite3.Binary(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+    def _loads(self, data):
+        return pickle.loads(bytes(data))
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def keys(self):
+        """Return the cache keys, most recently used first."""
+        rows = self._conn.execute("SELECT key FROM cache ORDER BY atime DESC")
+        return [self._loads(key) for key, in rows]
+
+    def values(self):
+        """Return the cache values, most recently used first."""
+        rows = self._conn.execute("SELECT value FROM cache ORDER BY atime DESC")
+        return [self._loads(value) for value, in rows]
+
+    def _dump_items(self):
+        cursor = self._conn.execute("SELECT key, value FROM cache ORDER BY atime")
+
+        while True:
+            rows = cursor.fetchmany(DUMP_BATCH_SIZE)
+            if not rows:
+                break
+
+            for key, value in rows:
+                yield self._loads(key), self._loads(value), None
+
+    def _load_items(self, items):
+        """Insert a batch in one transaction. Each row gets a slightly later
+        access time than the one before it so the dumped order is kept.
+        """
+        rows = [(self._dumps(key), self._dumps(value)) for key, value, _ in items]
+        now = time.time()
+        self._write(rows, [now + index * 1e-6 for index in xrange(len(rows))])
+
+    def _touch(self, rows, now):
+        """Update the access time of rows which have not been touched in
+        the last DISK_CACHE_ATIME_RESOLUTION seconds.
+        """
+        stale = [(now, kbytes) for kbytes, _, atime in rows
+                 if now - atime > DISK_CACHE_ATIME_RESOLUTION]
+
+        if stale:
+            self._conn.executemany("UPDATE cache SET atime = ? WHERE key = ?", stale)
+
+    def get(self, key):
+        kbytes = self._dumps(key)
+        row = self._conn.execute(
+            "SELECT key, value, atime FROM cache WHERE key = ?", (kbytes,)
+        ).fetchone()
+
+        if row is None:
+            raise KeyError(key)
+
+        self._touch([row], time.time())
+        return self._loads(row[1])
 
-        self._maintain_size()
+    def get_many(self, keys):
+        """Return a dict of the items found for the input `keys`."""
+        keys = dict((bytes(self._dumps(key)), key) for key in keys)
+        kbytes = [sqlite3.Binary(k) for k in keys]
+        found, rows = {}, []
 
-    def _maintain_size(self):
-        while self._size > self._max_size:
-            key = self._order.pop()
-            del self._storage[key]
-            self._size -= 1
+        for index in xrange(0, len(kbytes), self._BATCH_SIZE):
+            batch = kbytes[index:index + self._BATCH_SIZE]
+            query = "SELECT key, value, atime FROM cache WHERE key IN (%s)" % ",".join("?" * len(batch))
+            rows.extend(self._conn.execute(query, batch))
 
+        for kbyte, value, _ in rows:
+            found[keys[bytes(kbyte)]] = self._loads(value)
 
-def memoize(cache_or_func):
-    def keyfunc(args, kwargs):
-        return unicode(args) + unicode(sorted(kwargs.iteritems()))
+        self._touch(rows, time.time())
+        return found
+
+    def _put(self, conn, kbytes, vbytes, now):
+        """Insert a row and return the change in total bytes."""
+        old = conn.execute("SELECT size FROM cache WHERE key = ?", (kbytes,)).fetchone()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, size, atime) VALUES (?, ?, ?, ?)",
+            (kbytes, vbytes, len(vbytes), now)
+        )
+        return len(vbytes) - (old[0] if old else 0)
+
+    def _delete(self, conn, kbytes):
+        """Delete a row if it exists and return the change in total bytes."""
+        old = conn.execute("SELECT size FROM cache WHERE key = ?", (kbytes,)).fetchone()
+
+        if old is None:
+            return 0
+
+        conn.execute("DELETE FROM cache WHERE key = ?", (kbytes,))
+        return -old[0]
+
+    def _write(self, rows, atimes):
+        """Insert pickled ``(key, value)`` `rows` in one transaction.
+
+        A value larger than max_bytes is not stored, and any old row for
+        its key is deleted so that the old value isn't served instead.
+        """
+        if not rows:
+            return
+
+        with self._transaction() as conn:
+            delta = 0
+
+            for (kbytes, vbytes), atime in zip(rows, atimes):
+                if len(vbytes) <= self._max_bytes:
+                    delta += self._put(conn, kbytes, vbytes, atime)
+                else:
+                    delta += self._delete(conn, kbytes)
+
+            self._evict(conn, delta)
+
+    def _evict(self, conn, delta):
+        """Apply `delta` to the total size and remove the least recently
+        used rows until the total is under max_bytes.
+        """
+        conn.execute("UPDATE meta SET bytes = bytes + ? WHERE id = 0", (delta,))
+        total = conn.execute("SELECT bytes FROM meta WHERE id = 0").fetchone()[0]
+
+        while total > self._max_bytes:
+            rows = conn.execute(
+                "SELECT key, size FROM cache ORDER BY atime LIMIT ?",
+                (self._EVICT_BATCH_SIZE,)
+            ).fetchall()
+
+            if not rows:
+                break
+
+            removed = []
+            for kbytes, size in rows:
+                removed.append((kbytes,))
+                total -= size
+                if total <= self._max_bytes:
+                    break
+
+            conn.executemany("DELETE FROM cache WHERE key = ?", removed)
+
+        conn.execute("UPDATE meta SET bytes = ? WHERE id = 0", (max(total, 0),))
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        """Insert each ``(key, value)`` pair in `items` in one transaction."""
+        rows = [(self._dumps(key), self._dumps(value)) for key, value in items]
+        self._write(rows, [time.time()] * len(rows))
+
+
+class TieredCache(BaseCache):
+    """A two-level cache with a small process-local L1 cache in front of a
+    shared L2 cache.
+
+    Hot keys are served from the L1 cache without any IPC. L1 misses fall
+    through to the L2 cache and L2 hits are copied into L1. Writes go to
+    both levels (write-through).
+
+    Each process has its own L1 cache and hit counters. A worker process
+    starts with a copy of the parent's L1 contents, but its counters start
+    at zero.
+
+    L1 items expire after `ttl` seconds. The L1 cache doesn't know when an
+    item copied from L2 was first put, so it can outlive its L2 copy by up
+    to `ttl` seconds.
+
+    Args:
+        cache: The shared L2 cache (e.g., an LRUCache).
+        size: The maximum number of items in the L1 cache.
+        ttl: The number of seconds an item lives in the L1 cache. Defaults
+            to the ttl of the L2 cache, if it has one. If None and the L2
+            cache has no ttl, L1 items do not expire.
+    """
+
+    def __init__(self, cache, size=DEFAULT_L1_CACHE_SIZE, ttl=None):
+        if not size:
+            raise ValueError("TieredCache size must be > 0")
+
+        if ttl is None:
+            ttl = getattr(cache, "ttl", None)
+
+        self._l1 = LRUStore(size, ttl=ttl)
+        self._l2 = cache
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self._pid = os.getpid()
+        self._counters = dict.fromkeys(("l1_hits", "l2_hits", "misses"), 0)
+
+    def _count(self, name):
+        if self._pid != os.getpid():
+            self._reset_counters()  # We're in a new process.
+        self._counters[name] += 1
+
+    def keys(self):
+        return self._l2.keys()
+
+    def values(self):
+        return self._l2.values()
+
+    def close(self):
+        """Close the L2 cache, if it can be closed."""
+        if hasattr(self._l2, "close"):
+            self._l2.close()
+
+    def dump(self, path):
+        """Write the L2 cache contents to `path`."""
+        self._l2.dump(path)
+
+    def load(self, path):
+        """Load a dump into the L2 cache. The L1 cache fills from the L2
+        cache as keys are used.
+        """
+        self._l2.load(path)
+
+    def get(self, key):
+        try:
+            value = self._l1.get(key)
+        except KeyError:
+            pass
+        else:
+            self._count("l1_hits")
+            return value
+
+        try:
+            value = self._l2.get(key)
+        except KeyError:
+            self._count("misses")
+            raise
+
+        self._count("l2_hits")
+        self._l1.put(key, value)
+        return value
+
+    def get_many(self, keys):
+        """Look up `keys` in the L1 cache, then look up all L1 misses in
+        the L2 cache at once.
+        """
+        found, missing = {}, []
+
+        for key in keys:
+            try:
+                found[key] = self._l1.get(key)
+            except KeyError:
+                missing.append(key)
+            else:
+                self._count("l1_hits")
+
+        if not missing:
+            return found
+
+        shared = self._l2.get_many(missing)
+
+        for key, value in shared.iteritems():
+            self._count("l2_hits")
+            self._l1.put(key, value)
+
+        for _ in xrange(len(missing) - len(shared)):
+            self._count("misses")
+
+        found.update(shared)
+        return found
+
+    def put(self, key, value):
+        self._l2.put(key, value)
+        self._l1.put(key, value)
+
+    def put_many(self, items):
+        items = list(items)
+        self._l2.put_many(items)
+
+        for key, value in items:
+            self._l1.put(key, value)
+
+    def stats(self):
+        """Return the hit and miss counts for each tier in this process.
+
+        L1 misses are lookups which went to the L2 cache. L2 misses are
+        lookups which missed both tiers. If the L2 cache has a stats()
+        method, its stats (which cover every process) are included under
+        ``"shared"``.
+        """
+        if self._pid != os.getpid():
+            self._reset_counters()
+
+        counters = self._counters
+        l1_misses = counters["l2_hits"] + counters["misses"]
+
+        def tier(hits, misses):
+            lookups = hits + misses
+            rate = float(hits) / lookups if lookups else 0.0
+            return {"hits": hits, "misses": misses, "hit_rate": rate}
+
+        stats = {
+            "l1": tier(counters["l1_hits"], l1_misses),
+            "l2": tier(counters["l2_hits"], counters["misses"]),
+        }
+
+        if hasattr(self._l2, "stats"):
+            stats["shared"] = self._l2.stats()
+        return stats
+
+
+# Types which marshal can serialize quickly and unambiguously.
+_SIMPLE_TYPES = frozenset([int, long, float, bool, str, unicode, type(None)])
+
+
+def _is_simple(value):
+    """Return True if `value` is made up of only _SIMPLE_TYPES and tuples."""
+    kind = type(value)
+
+    if kind in _SIMPLE_TYPES:
+        return True
+    elif kind is tuple:
+        return all(_is_simple(x) for x in value)
+    return False
+
+
+def reprkey(args, kwargs):
+    """Build a cache key from the text representation of the inputs.
+
+    Note:
+        Keys can be very large and different objects with the same repr
+        will collide. Prefer hashkey().
+    """
+    return unicode(args) + unicode(sorted(kwargs.iteritems()))
+
+
+def hashkey(args, kwargs):
+    """Build a compact, fixed-size cache key from the inputs.
+
+    The inputs are serialized and hashed with SHA-1, so keys are always 20
+    bytes no matter how large the arguments are. Ints, floats, strings and
+    tuples of them are serialized with marshal, which is fast and keeps
+    values of different types distinct. Other values (including unhashable
+    ones like lists and dicts) are pickled.
+
+    Raises:
+        TypeError: If the inputs can't be pickled. Their repr isn't used
+            instead, since reprs like ``<Foo object at 0x...>`` can be
+            shared by different objects.
+    """
+    if kwargs:
+        inputs = (args, tuple(sorted(kwargs.iteritems())))
+    else:
+        inputs = args
+
+    if _is_simple(inputs):
+        data = marshal.dumps(inputs)
+    else:
+        try:
+            data = pickle.dumps(inputs, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError) as ex:
+            raise TypeError("Cannot build a cache key from unpicklable inputs: %s" % ex)
+
+    return hashlib.sha1(data).digest()
+
+
+def memoize(cache_or_func=None, key=hashkey, local_size=None, batched=False):
+    """Decorator which caches the return values of the wrapped function.
+
+    Example:
+    >>> @memoize
+    ... def foo(x): ...
+    >>> @memoize(SharedMemoryCache(), key=reprkey)
+    ... def bar(x): ...
+    >>> @memoize(LRUCache(), batched=True)
+    ... def baz(items):
+    ...     return [expensive(x) for x in items]
+
+    In batched mode, the first argument of the wrapped function is a list
+    of items and it must return a list of results in the same order. Each
+    item is cached separately (together with any remaining arguments). The
+    cache is checked for every item with one get_many() call, the function
+    is called once with only the items that were missing, and the new
+    results are stored with one put_many() call.
+
+    Args:
+        cache_or_func: The cache object (anything supporting ``cache[key]``
+            lookups that raise KeyError on a miss, and ``cache[key] = value``)
+            or the function to decorate. If no cache is provided, a new
+            LRUCache is used.
+        key: A function which accepts the ``(args, kwargs)`` of a call and
+            returns the cache key. Default is hashkey(), which raises
+            TypeError for inputs that can't be pickled.
+        local_size: If provided, the cache is wrapped in a TieredCache with
+            a process-local L1 cache holding this many items.
+        batched: If True, the wrapped function accepts a list of items and
+            returns a list of results.
+    """
+    keyfunc = key
 
     def decorator(func):
         @functools.wraps(func)
@@ -82,9 +1549,40 @@ def memoize(cache_or_func):
             return retval
         return inner
 
+    def batch_decorator(func):
+        @functools.wraps(func)
+        def inner(items, *args, **kwargs):
+            items = list(items)
+            keys = [keyfunc((item,) + args, kwargs) for item in items]
+            found = cache.get_many(set(keys))
+
+            missing = collections.OrderedDict()
+            for item, key in zip(items, keys):
+                if key not in found:
+                    missing.setdefault(key, item)
+
+            if missing:
+                results = func(missing.values(), *args, **kwargs)
+                computed = zip(missing.keys(), results)
+                cache.put_many(computed)
+                found.update(computed)
+
+            return [found[key] for key in keys]
+        return inner
+
+    if batched:
+        decorator = batch_decorator
+
+    def tiered(cache):
+        if local_size:
+            return TieredCache(cache, local_size)
+        return cache
+
     if callable(cache_or_func):
-        cache, func = LRUCache(), cache_or_func
+        cache, func = tiered(LRUCache()), cache_or_func
         return decorator(func)
-
-    cache = cache_or_func
-    return decorator
\ No newline at end of file
+    elif cache_or_func is None:
+        cache = tiered(LRUCache())
+    else:
+        cache = tiered(cache_or_func)
+    return decorator
@@ -0,0 +1,122 @@
+"""
+Objects which decide how many tasks are sent to a worker process in a
+single message.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+
+from buckshot import constants
+
+LOG = logging.getLogger(__name__)
+
+AUTO = "auto"  # chunksize value which selects the AdaptiveChunker.
+
+
+class FixedChunker(object):
+    """Sends the same number of tasks in every message.
+
+    Args:
+        size: The number of tasks per message.
+    """
+
+    def __init__(self, size=1):
+        if size < 1:
+            raise ValueError("chunksize must be > 0")
+        self.size = size
+
+    def update(self, chunk):
+        """Fixed chunks ignore result timings."""
+        pass
+
+
+class AdaptiveChunker(object):
+    """Grows or shrinks the number of tasks sent per message based on the
+    observed task execution time and queue transit time.
+
+    The chunk size is chosen so that each message represents roughly
+    `target` seconds of worker time. If the measured round trip cost of a
+    message is high, the target is raised so IPC stays under `overhead`
+    (a fraction) of the time spent per message.
+
+    Args:
+        target: The desired worker execution time per message, in seconds.
+        overhead: The maximum fraction of message time that may be spent
+            moving the message between processes.
+        max_size: The maximum number of tasks per message.
+        smoothing: Weight given to the newest observation in the moving
+            averages. Must be in (0, 1].
+    """
+
+    def __init__(self, target=None, overhead=constants.CHUNK_MAX_OVERHEAD,
+                 max_size=constants.CHUNK_MAX_SIZE, smoothing=0.25):
+        if target is None:
+            target = constants.CHUNK_TARGET_TIME
+
+        if target <= 0:
+            raise ValueError("chunk target time must be > 0")
+
+        self.size = 1
+        self._target = target
+        self._overhead = overhead
+        self._max_size = max_size
+        self._smoothing = smoothing
+        self._task_time = None  # Moving average of seconds per task.
+        self._transit_time = None  # Moving average of one-way message latency.
+
+    def _average(self, current, value):
+        if current is None:
+            return value
+        return current + self._smoothing * (value - current)
+
+    def _target_time(self):
+        """Return the per-message worker time to aim for."""
+        if not self._transit_time:
+            return self._target
+
+        round_trip = 2 * self._transit_time
+        return max(self._target, round_trip / self._overhead)
+
+    def update(self, chunk):
+        """Record the timings for a ResultChunk and recompute the size.
+
+        The transit time is measured by the worker on the way in. The time a
+        result spends waiting for the caller to read it is left out, so a
+        slow consumer doesn't look like expensive IPC.
+
+        Args:
+            chunk: A ResultChunk returned from a worker.
+        """
+        if not chunk.results:
+            return
+
+        task_time = chunk.elapsed / len(chunk.results)
+        transit_time = chunk.transit
+
+        self._task_time = self._average(self._task_time, task_time)
+        self._transit_time = self._average(self._transit_time, transit_time)
+
+        if self._task_time > 0:
+            size = int(self._target_time() / self._task_time)
+        else:
+            size = self._max_size
+
+        # Grow gradually so one fast outlier doesn't produce a huge chunk,
+        # but shrink right away when tasks get slower.
+        size = min(size, self.size * 2, self._max_size)
+        size = max(size, 1)
+
+        if size != self.size:
+            LOG.debug("Changing chunk size from %d to %d", self.size, size)
+        self.size = size
+
+
+def get_chunker(chunksize, target=None):
+    """Return a chunker for the input `chunksize`, which is either a
+    positive integer or ``"auto"``.
+    """
+    if chunksize == AUTO:
+        return AdaptiveChunker(target=target)
+    return FixedChunker(chunksize)
@@ -9,3 +9,16 @@ import multiprocessing
 
 CPU_COUNT = multiprocessing.cpu_count()  # Number of CPUs on the system.
 TASK_TIMEOUT = 60 * 60 * 12 # 12 hours
+
+# Adaptive chunk sizing.
+CHUNK_TARGET_TIME = 0.05  # Seconds of worker time per task chunk.
+CHUNK_MAX_OVERHEAD = 0.03  # Maximum fraction of chunk time spent on IPC.
+CHUNK_MAX_SIZE = 4096  # Maximum number of tasks per chunk.
+
+DEDUPE_WINDOW = 1024  # Completed inputs remembered when deduplicating tasks.
+
+CANCEL_POLL_INTERVAL = 0.1  # Seconds between checks for a cancelled readahead.
+
+TEARDOWN_TIMEOUT = 10  # Seconds to wait for workers to run their teardown.
+
+POOL_IDLE_TIMEOUT = 60  # Seconds before an idle pooled distributor is stopped.
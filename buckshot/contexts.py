@@ -9,6 +9,7 @@ __all__ = ["distributed"]
 
 import logging
 
+from buckshot import pools
 from buckshot import logutils
 from buckshot.distributors import ProcessPoolDistributor
 
@@ -26,25 +27,119 @@ class distributed(object):
         func: A callable object to be distributed across subprocesses.
         processes (int): The number of subprocesses to spawn. If not
             provided, the number of CPUs on the system will be used.
+        ordered (bool): If True, results are returned in the order of their
+            respective inputs.
+        timeout (float): Number of seconds to wait before killing a worker
+            process. If None, no timeout is used.
+        chunksize (int): The number of inputs sent to a worker process in a
+            single message. Larger values reduce IPC overhead for short
+            tasks. Default is 1. If ``"auto"``, the chunk size is adjusted
+            while running based on observed task and IPC latency.
+        chunktime (float): The target worker execution time per message, in
+            seconds, when `chunksize` is ``"auto"``.
+        dedupe: If True, inputs which are equal to (and of the same types
+            as) an input that is in flight or recently completed are not
+            sent to a worker and get a copy of that input's result. If an integer, the number of
+            recently completed inputs to remember.
+        share_threshold (int): If not None, NumPy array inputs and results
+            of at least this many bytes are passed through shared memory
+            instead of being pickled through a pipe. Requires NumPy.
+        context: An object the work function can read by calling
+            ``buckshot.get_context()`` in the worker process. Use this for
+            large read-only data (e.g., lookup tables) which would otherwise
+            be pickled with every input. Workers inherit it when they are
+            forked, so changes made after the workers start are not seen.
+        initializer: A function called once in each worker process before
+            it runs any inputs, e.g. to load a model or open files. Workers
+            started to replace timed out ones are initialized too.
+        initargs (tuple): Arguments passed to `initializer`.
+        teardown: A function called in each worker process when the
+            workers are stopped.
+        readahead (int): If set, inputs are sent to workers and results
+            are collected by a background thread, which keeps up to this
+            many results ready for the caller. Workers stay busy while the
+            caller handles each result.
+        prefetch (int): The number of messages of inputs queued for each
+            worker process. Default is 1. Raise this if workers sit idle
+            waiting for inputs, e.g. when tasks are very short.
+        reorder_window (int): The maximum number of results held back
+            while waiting for an earlier input to finish when `ordered` is
+            True. New inputs are not sent while the window is full. If
+            None, there is no limit.
+        transport (str): How inputs and results travel between processes.
+            ``"queue"`` shares one task queue and one result queue between
+            all workers. ``"pipe"`` gives each worker its own pipe and sends
+            inputs only to workers which are ready for them. Default is
+            ``"pipe"`` if `schedule` or `affinity` is set, otherwise
+            ``"queue"``.
+        schedule (str): How inputs are assigned to workers. Requires the
+            ``"pipe"`` transport. ``"round-robin"`` takes the workers in
+            turn, ``"least-outstanding"`` picks the ready worker with the
+            fewest unfinished inputs and ``"work-stealing"`` gives each
+            worker its own backlog of inputs, which idle workers steal
+            from. If None (the default), the first ready worker gets the
+            next inputs.
+        affinity: A function called with each input's arguments which
+            returns a hashable key. Inputs with the same key go to the same
+            worker, so anything a worker caches for that key stays useful.
+            A worker with nothing to do takes inputs meant for a busy one.
+            Can't be combined with `schedule`. Requires the ``"pipe"``
+            transport.
+        pool: If True, worker processes are taken from (and returned to) the
+            module-level ``buckshot.pools.DEFAULT_POOL`` instead of being
+            created and destroyed with this context. A
+            ``buckshot.pools.DistributorPool`` can be passed to use a
+            specific pool.
     """
 
-    def __init__(self, func, processes=None, ordered=True, timeout=None):
+    def __init__(self, func, processes=None, ordered=True, timeout=None,
+                 chunksize=1, chunktime=None, dedupe=False, share_threshold=None,
+                 context=None, initializer=None, initargs=(), teardown=None,
+                 readahead=None, prefetch=1, reorder_window=None,
+                 transport=None, schedule=None, affinity=None, pool=None):
         self._ordered = bool(ordered)
-        self._distributor = ProcessPoolDistributor(
-            func=func,
+        self._pool = pools.get_pool(pool)
+        self._func = func
+        self._options = dict(
             num_processes=processes,
-            timeout=timeout
+            timeout=timeout,
+            chunksize=chunksize,
+            chunktime=chunktime,
+            dedupe=dedupe,
+            share_threshold=share_threshold,
+            context=context,
+            initializer=initializer,
+            initargs=initargs,
+            teardown=teardown,
+            readahead=readahead,
+            prefetch=prefetch,
+            reorder_window=reorder_window,
+            transport=transport,
+            schedule=schedule,
+            affinity=affinity
         )
 
+        if self._pool is None:
+            self._distributor = ProcessPoolDistributor(func=func, **self._options)
+        else:
+            self._distributor = None
+
     @logutils.tracelog(LOG)
     def __enter__(self):
-        self._distributor.start()
+        if self._pool is None:
+            self._distributor.start()
+        else:
+            self._distributor = self._pool.acquire(self._func, **self._options)
         return self
 
     @logutils.tracelog(LOG)
     def __exit__(self, ex_type, ex_value, traceback):
-        """Kill any spawned subprocesses."""
-        self._distributor.stop()
+        """Kill any spawned subprocesses or return them to the pool."""
+        if self._pool is None:
+            self._distributor.stop()
+        else:
+            self._pool.release(self._distributor)
+            self._distributor = None
 
     @logutils.tracelog(LOG)
     def __call__(self, iterable):
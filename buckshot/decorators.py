@@ -49,6 +49,64 @@ def distribute(*func, **opts):
             respective inputs.
         timeout (float): Number of seconds to wait before killing a worker
             process. If None, no timeout is used.
+        chunksize (int): The number of inputs sent to a worker process in a
+            single message. Larger values reduce IPC overhead for short
+            tasks. Default is 1. If ``"auto"``, the chunk size is adjusted
+            while running based on observed task and IPC latency.
+        chunktime (float): The target worker execution time per message, in
+            seconds, when `chunksize` is ``"auto"``.
+        dedupe: If True, inputs which are equal to (and of the same types
+            as) an input that is in flight or recently completed are not
+            sent to a worker and get a copy of that input's result. If an integer, the number of
+            recently completed inputs to remember.
+        share_threshold (int): If not None, NumPy array inputs and results
+            of at least this many bytes are passed through shared memory
+            instead of being pickled through a pipe. Requires NumPy.
+        context: An object the work function can read by calling
+            ``buckshot.get_context()`` in the worker process. Use this for
+            large read-only data (e.g., lookup tables) which would otherwise
+            be pickled with every input. Workers inherit it when they are
+            forked, so changes made after the workers start are not seen.
+        initializer: A function called once in each worker process before
+            it runs any inputs, e.g. to load a model or open files. Workers
+            started to replace timed out ones are initialized too.
+        initargs (tuple): Arguments passed to `initializer`.
+        teardown: A function called in each worker process when the
+            workers are stopped.
+        readahead (int): If set, inputs are sent to workers and results
+            are collected by a background thread, which keeps up to this
+            many results ready for the caller. Workers stay busy while the
+            caller handles each result.
+        prefetch (int): The number of messages of inputs queued for each
+            worker process. Default is 1. Raise this if workers sit idle
+            waiting for inputs, e.g. when tasks are very short.
+        reorder_window (int): The maximum number of results held back
+            while waiting for an earlier input to finish when `ordered` is
+            True. New inputs are not sent while the window is full. If
+            None, there is no limit.
+        transport (str): How inputs and results travel between processes.
+            ``"queue"`` shares one task queue and one result queue between
+            all workers. ``"pipe"`` gives each worker its own pipe and sends
+            inputs only to workers which are ready for them. Default is
+            ``"pipe"`` if `schedule` or `affinity` is set, otherwise
+            ``"queue"``.
+        schedule (str): How inputs are assigned to workers. Requires the
+            ``"pipe"`` transport. ``"round-robin"`` takes the workers in
+            turn, ``"least-outstanding"`` picks the ready worker with the
+            fewest unfinished inputs and ``"work-stealing"`` gives each
+            worker its own backlog of inputs, which idle workers steal
+            from. If None (the default), the first ready worker gets the
+            next inputs.
+        affinity: A function called with each input's arguments which
+            returns a hashable key. Inputs with the same key go to the same
+            worker, so anything a worker caches for that key stays useful.
+            A worker with nothing to do takes inputs meant for a busy one.
+            Can't be combined with `schedule`. Requires the ``"pipe"``
+            transport.
+        pool: If True, reuse worker processes from the module-level
+            ``buckshot.pools.DEFAULT_POOL`` across calls instead of spawning
+            new ones each time. A ``buckshot.pools.DistributorPool`` can be
+            passed to use a specific pool.
     """
     if func and opts:
         raise ValueError("Cannot provide positional arguments.")
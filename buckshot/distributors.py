@@ -2,16 +2,24 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import Queue
+import time
 import logging
 import threading
 import collections
 import multiprocessing
 
+from buckshot import caches
 from buckshot import errors
+from buckshot import signals
+from buckshot import chunkers
+from buckshot import threads
 from buckshot import lockutils
 from buckshot import constants
+from buckshot import transports
+from buckshot import schedulers
+from buckshot import sharedarrays
 from buckshot.workers import TaskWorker
-from buckshot.tasks import TaskIterator
+from buckshot.tasks import TaskChunk, TaskIterator, TaskDeduplicator
 
 
 LOG = logging.getLogger(__name__)
@@ -25,19 +33,119 @@ class ProcessPoolDistributor(object):
         num_processes: The number of worker processes to spawn.
         timeout: The maximum amount of time to wait for a result from
             a worker process. Default is None (unbounded).
+        chunksize: The number of tasks to send to a worker process in a
+            single message. Default is 1. If ``"auto"``, the chunk size is
+            adjusted based on observed task and IPC latency.
+        chunktime: The target worker execution time per message, in seconds,
+            when `chunksize` is ``"auto"``.
+        dedupe: If True, tasks with the same arguments as a task which is
+            in flight or recently completed are not sent to a worker and
+            receive a copy of that task's result. If an integer, the number
+            of recently completed inputs to remember (0 only matches tasks
+            in flight). Default is False.
+        share_threshold: If not None, NumPy array arguments and results of
+            at least this many bytes are passed through shared memory files
+            instead of being pickled. Argument files are removed when the
+            task's result is received and result files when the result is
+            attached in this process.
+        context: An object which the work function can read with
+            ``buckshot.get_context()``. Worker processes inherit it when
+            they are forked, so it is never sent with a task.
+        initializer: A function called with `initargs` in each worker
+            process when it starts, including workers which replace timed
+            out ones. The time it takes is recorded in `init_times` rather
+            than counted as task time.
+        initargs: A tuple of arguments for `initializer`.
+        teardown: A function called in each worker process when stop() is
+            called. If set, stop() asks workers to exit and waits up to
+            TEARDOWN_TIMEOUT seconds before killing them.
+        readahead: If set, tasks are sent and results are received by a
+            background thread, which buffers up to this many results that
+            the caller has not consumed yet. This keeps workers busy while
+            the caller handles each result.
+        prefetch: The number of task chunks queued per worker process.
+            Default is 1. Higher values keep workers busy when the parent
+            is slow to send tasks, at the cost of memory and less even
+            load balancing.
+        reorder_window: If set, no new tasks are read from the input while
+            this many results are waiting to be returned behind an
+            unfinished earlier task, which bounds memory use in imap() when
+            one task is slow.
+        transport: How chunks and results are passed between this process
+            and the workers. ``"queue"`` uses one task queue and one result
+            queue shared by every worker. ``"pipe"`` gives each worker its
+            own Pipe and sends each chunk to a worker with fewer than
+            `prefetch` chunks outstanding. Default is ``"pipe"`` if
+            `schedule` or `affinity` is set, otherwise ``"queue"``.
+        schedule: How chunks are assigned to workers. If None (the
+            default), each chunk goes to whichever worker is free first.
+            ``"round-robin"`` sends chunks to the workers in turn,
+            ``"least-outstanding"`` sends each chunk to the free worker
+            with the fewest unfinished tasks and ``"work-stealing"`` deals
+            tasks out to a deque for each worker and lets idle workers
+            take tasks from the longest one. Requires the ``"pipe"``
+            transport.
+        affinity: A function called in this process with each task's
+            arguments which returns a hashable key. Tasks with the same key
+            are sent to the same worker, so per-process caches and state
+            built up for that key are reused. When that worker is busy and
+            another has nothing to do, the idle worker takes some of its
+            tasks. Can't be combined with `schedule`. Requires the
+            ``"pipe"`` transport.
     """
 
-    def __init__(self, func, num_processes=None, timeout=None):
+    def __init__(self, func, num_processes=None, timeout=None, chunksize=1,
+                 chunktime=None, dedupe=False, share_threshold=None,
+                 context=None, initializer=None, initargs=(), teardown=None,
+                 readahead=None, prefetch=1, reorder_window=None,
+                 transport=None, schedule=None, affinity=None):
+        routed = schedule is not None or affinity is not None
+
+        if transport is None:
+            transport = transports.PIPE if routed else transports.QUEUE
+
+        if prefetch < 1:
+            raise ValueError("prefetch must be > 0")
+        if reorder_window is not None and reorder_window < 1:
+            raise ValueError("reorder_window must be > 0")
+        if transport not in (transports.QUEUE, transports.PIPE):
+            raise ValueError("Unknown transport: %r" % (transport,))
+        if schedule is not None and schedule not in schedulers.SCHEDULES:
+            raise ValueError("Unknown schedule: %r" % (schedule,))
+        if schedule is not None and affinity is not None:
+            raise ValueError("schedule cannot be combined with affinity")
+        if routed and transport != transports.PIPE:
+            raise ValueError("schedule and affinity require the %r transport" % transports.PIPE)
+
         self._num_processes = num_processes or constants.CPU_COUNT
         self._func = func  # Function to distribute across processes
         self._timeout = timeout  # Timeout for running tasks.
+        self._chunker = chunkers.get_chunker(chunksize, chunktime)  # Decides tasks per message.
+        self._dedupe_window = _dedupe_window(dedupe)  # Completed inputs remembered, or None.
+        self._share_threshold = share_threshold  # Minimum bytes of a shared array.
+        self._context = context  # Read-only object inherited by workers.
+        self._initializer = initializer  # Called when each worker starts.
+        self._initargs = initargs
+        self._teardown = teardown  # Called when each worker is stopped.
+        self._readahead = readahead  # Results buffered by the feeder thread.
+        self._prefetch = prefetch  # Task chunks queued per worker.
+        self._reorder_window = reorder_window  # Maximum results waiting to be returned.
+        self._transport_name = transport  # Name of the transport to start.
+        self._schedule = schedule  # Name of the scheduling policy.
+        self._affinity = affinity  # Returns the routing key for a task's arguments.
         self._lock = threading.Lock()
         self._processes = None # Map of pid => Process object.
-        self._worker = None  # Worker object.
-        self._task_queue = None   # Worker tasks
-        self._result_queue = None  # Worker results
-        self._tasks_in_progress = None  # Tasks started with unreturned results
+        self._slots = None  # Map of pid => worker slot.
+        self._workers = None  # TaskWorker object for each slot.
+        self._transport = None  # Carries chunks and results to and from workers.
+        self._tasks_in_progress = None  # Tasks read from the input with unreturned results
         self._task_results_waiting = None # Task results that are waiting to be returned.
+        self._scheduler = None  # Holds unsent tasks and picks their workers.
+        self._deduplicator = None  # Matches up tasks with the same arguments.
+        self._task_shared_arrays = None  # Task id => shared argument handles.
+        self._share_owner = None  # Name of the shared array files we own.
+        self._init_times = None  # pid => seconds spent in the initializer.
+        self._cancelled = None  # Set when the caller abandons a readahead map.
 
     @property
     def is_started(self):
@@ -55,20 +163,28 @@ class ProcessPoolDistributor(object):
             return False
         return True
 
-    def _create_and_register_process(self):
-        process = multiprocessing.Process(target=self._worker)
+    @property
+    def init_times(self):
+        """Return a dict of worker pid => seconds spent in the initializer,
+        for the workers whose signals.Initialized message has been received.
+        """
+        return dict(self._init_times or {})
+
+    def _create_and_register_process(self, slot):
+        process = multiprocessing.Process(target=self._workers[slot])
         process.daemon = True  # This will die if parent process dies.
         process.start()
 
-        LOG.info("Created new subprocess: %d", process.pid)
+        LOG.info("Created new subprocess %d in slot %d", process.pid, slot)
         self._processes[process.pid] = process
+        self._slots[process.pid] = slot
 
     @lockutils.lock_instance("_lock")
     def start(self):
         """Start the worker processes and return self.
 
-        * Create an input and output queue for worker processes to receive
-          tasks and send results.
+        * Create the transport which worker processes use to receive tasks
+          and send results.
         * Create a task registry so worker processes can identify what
           task they are working on.
 
@@ -77,56 +193,231 @@ class ProcessPoolDistributor(object):
             dies the child processes will be killed.
         """
         self._processes = {}
-        self._result_queue = multiprocessing.Queue()  # TODO: Should this have a maxsize?
-        self._task_queue = multiprocessing.Queue(maxsize=self._num_processes)
+        self._slots = {}
+        self._transport = transports.get_transport(
+            self._transport_name,
+            num_slots=self._num_processes,
+            prefetch=self._prefetch
+        )
         self._tasks_in_progress = collections.OrderedDict()  # Keep track of the order of tasks sent
         self._task_results_waiting = {}  # task id => Result
+        self._scheduler = schedulers.get_scheduler(
+            self._schedule,
+            num_slots=self._num_processes,
+            affinity=self._affinity
+        )
+        self._task_shared_arrays = {}  # task id => [SharedArray, ...]
+        self._share_owner = sharedarrays.new_owner()
+        self._init_times = {}
+
+        # Workers must share the parent's cache service, so it has to be
+        # running before they are forked.
+        caches.before_fork()
+
+        self._workers = [self._make_worker(slot) for slot in xrange(self._num_processes)]
+
+        for slot in xrange(self._num_processes):
+            self._create_and_register_process(slot)
 
-        self._worker = TaskWorker(
+        return self
+
+    def _make_worker(self, slot):
+        """Return the TaskWorker for the worker process in `slot`."""
+        input_channel, output_channel = self._transport.channels(slot)
+
+        return TaskWorker(
             func=self._func,
             timeout=self._timeout,
-            input_queue=self._task_queue,
-            output_queue=self._result_queue
+            input_queue=input_channel,
+            output_queue=output_channel,
+            share_threshold=self._share_threshold,
+            share_owner=self._share_owner,
+            context=self._context,
+            initializer=self._initializer,
+            initargs=self._initargs,
+            teardown=self._teardown
         )
 
-        for _ in xrange(self._num_processes):
-            self._create_and_register_process()
+    def _register_tasks(self, tasks):
+        """Register new `tasks` as in progress and return the ones which
+        need to be sent to a worker.
 
-        return self
+        Duplicate tasks are registered so results keep their input order,
+        but are not returned. Duplicates of recently completed tasks get
+        their result right away.
+        """
+        dedupe = self._deduplicator
+        registered = self._tasks_in_progress
+
+        for task in tasks:
+            registered[task.id] = task
+
+        if dedupe is None:
+            send = tasks
+        else:
+            send = []
+
+            for task in tasks:
+                if dedupe.add(task):
+                    send.append(task)
+                    continue
 
-    def _send_task(self, task):
-        self._task_queue.put_nowait(task)
-        self._tasks_in_progress[task.id] = task
+                result = dedupe.recent(task)
+                if result is not None:
+                    self._task_results_waiting[task.id] = result
+
+        return send
+
+    def _share_arguments(self, task):
+        """Replace large array arguments of `task` with shared memory
+        handles. The handles are kept until the task's result comes back.
+        """
+        owner = self._share_owner
+        threshold = self._share_threshold
+        args = tuple(sharedarrays.share(arg, threshold, owner) for arg in task.args)
+        handles = [arg for arg in args if isinstance(arg, sharedarrays.SharedArray)]
+
+        if handles:
+            task.args = args
+            self._task_shared_arrays[task.id] = handles
+
+    def _lookahead(self):
+        """Return the number of unsent tasks needed to fill every worker's
+        prefetch.
+        """
+        return self._num_processes * self._prefetch * self._chunker.size
+
+    def _fill(self, tasks):
+        """Read new tasks from `tasks` into the scheduler. Return True if
+        the input has run out.
+
+        Reading stops when the scheduler holds `lookahead` tasks, when this
+        call has read `lookahead` tasks, when twice that many tasks are
+        waiting for results or when the reorder window is full. Counting
+        every task read, not just the ones which are scheduled, keeps
+        deduplicated tasks from draining the whole input.
+        """
+        scheduler = self._scheduler
+        size = self._chunker.size
+        lookahead = self._lookahead()
+        read = 0
+
+        while (read < lookahead and
+               len(scheduler) < lookahead and
+               self._num_unfinished() < 2 * lookahead and
+               not self._is_window_full()):
+            new = tasks.take(size)
+            if not new:
+                return True
+
+            read += len(new)
+
+            for task in self._register_tasks(new):
+                scheduler.add(task)  # Before sharing, so affinity sees the arrays.
+
+                if self._share_threshold is not None:
+                    self._share_arguments(task)
+        return False
+
+    def _num_unfinished(self):
+        """Return the number of tasks in progress which have no result."""
+        return len(self._tasks_in_progress) - len(self._task_results_waiting)
+
+    def _is_window_full(self):
+        """Return True if the number of results waiting to be returned has
+        reached the reorder window.
+        """
+        window = self._reorder_window
+        return window is not None and len(self._task_results_waiting) >= window
+
+    def _send_chunks(self):
+        """Send chunks of the scheduled tasks until none are left or no
+        worker can take another chunk.
+        """
+        scheduler = self._scheduler
+        transport = self._transport
+
+        while scheduler:
+            try:
+                slot = scheduler.next_slot(transport)
+            except Queue.Full:
+                return
+
+            tasks = scheduler.take(slot, self._chunker.size)
+            if not tasks:
+                return
+
+            try:
+                transport.send(TaskChunk(tasks), slot)
+            except Queue.Full:
+                scheduler.requeue(tasks, slot)
+                return
+
+            scheduler.sent(slot, len(tasks))
 
     def _flush_result_queue(self):
-        """Empty the task result queue and yield all TaskResult objects.
+        """Read every message the workers have sent and yield a (slot,
+        message) tuple for each ResultChunk and signal.
 
         Note:
-            The first queue access blocks. All following attempts to
-            retrieve results are non-blocking.
+            Waiting for the first message blocks, unless every task in
+            progress already has a result waiting (e.g., deduplicated
+            tasks). All following reads are non-blocking. With readahead,
+            the wait gives up after CANCEL_POLL_INTERVAL seconds so the
+            background thread can see that the caller has gone away.
 
         Yields:
-            TaskResult objects.
+            (slot, message) tuples. The slot is None for the ``"queue"``
+            transport.
         """
-        yield self._result_queue.get()  # blocks
+        if len(self._tasks_in_progress) <= len(self._task_results_waiting):
+            timeout = 0
+        elif self._cancelled is not None:
+            timeout = constants.CANCEL_POLL_INTERVAL
+        else:
+            timeout = None  # blocks
 
-        while True:
-            try:
-                result = self._result_queue.get_nowait()  # non-blocking
-            except Queue.Empty:
-                break
-            yield result
+        for slot, message in self._transport.recv(timeout):
+            yield slot, message
 
     def _recv_results(self):
-        for result in self._flush_result_queue():
-            if isinstance(result, errors.SubprocessError):
-                raise RuntimeError(unicode(result))  # A subprocess died unexpectedly. Shut it down!
+        for slot, chunk in self._flush_result_queue():
+            if isinstance(chunk, errors.SubprocessError):
+                raise RuntimeError(unicode(chunk))  # A subprocess died unexpectedly. Shut it down!
+
+            if isinstance(chunk, signals.Initialized):
+                LOG.info("Subprocess %d initialized in %.3f seconds", chunk.pid, chunk.duration)
+                self._init_times[chunk.pid] = chunk.duration
+                continue
+
+            self._chunker.update(chunk)
+            self._scheduler.done(slot, len(chunk.results) + len(chunk.unprocessed))
 
-            if isinstance(result.value, errors.TaskTimeout):
-                self._handle_task_timeout(result)
+            if chunk.unprocessed:
+                LOG.debug("Re-sending %d unprocessed tasks", len(chunk.unprocessed))
+                self._scheduler.requeue(chunk.unprocessed, slot)
 
-            LOG.debug("Received result for task: %s", result.task_id)
-            self._task_results_waiting[result.task_id] = result
+            for result in chunk.results:
+                if isinstance(result.value, errors.TaskTimeout):
+                    self._handle_task_timeout(result)
+
+                LOG.debug("Received result for task: %s", result.task_id)
+                self._task_results_waiting[result.task_id] = result
+
+                if self._share_threshold is not None:
+                    self._attach_result(result)
+
+                if self._deduplicator is not None:
+                    for duplicate in self._deduplicator.complete(result):
+                        self._task_results_waiting[duplicate.task_id] = duplicate
+
+    def _attach_result(self, result):
+        """Attach a shared array result and release the task's shared
+        arguments, which no worker needs anymore.
+        """
+        result.value = sharedarrays.attach(result.value, claim=True)
+        handles = self._task_shared_arrays.pop(result.task_id, ())
+        sharedarrays.release(handles)
 
     def _handle_task_timeout(self, task_timeout):
         """Destroy the process that timed out and create a new one in
@@ -140,10 +431,10 @@ class ProcessPoolDistributor(object):
 
         # Kill the associated process so the thread stops.
         LOG.info("Subprocess %d timed out. Terminating...", pid)
-        self._kill_process(pid, join=True)
+        slot = self._kill_process(pid, join=True)
 
-        # Make a new process to replace it.
-        self._create_and_register_process()
+        # Make a new process to take over its slot.
+        self._create_and_register_process(slot)
 
     def _map_to_workers(self, iterable, result_getter):
         """Map the arguments in the input `iterable` to the worker processes.
@@ -158,22 +449,48 @@ class ProcessPoolDistributor(object):
         if not self.is_started:
             raise RuntimeError("Cannot process inputs: must call start() first.")
 
+        if self._readahead:
+            self._cancelled = threading.Event()
+            results = self._dispatch(iterable, result_getter)
+            results = threads.readahead(results, self._readahead, self._cancelled)
+        else:
+            self._cancelled = None
+            results = self._dispatch(iterable, result_getter)
+
+        for result in results:
+            yield result
+
+    def _dispatch(self, iterable, result_getter):
+        """Send chunks of tasks to the workers and yield results until every
+        task has a result. See _map_to_workers().
+        """
         tasks = TaskIterator(iterable)
-        task  = next(tasks)
+        scheduler = self._scheduler
+        cancelled = self._cancelled
+
+        if self._dedupe_window is not None:
+            self._deduplicator = TaskDeduplicator(self._dedupe_window)
 
         while True:
-            try:
-                self._send_task(task)
-                task = next(tasks)
-            except Queue.Full:
-                LOG.debug("Worker queue full. Waiting for results.")
-                for result in result_getter():  # I wish I had `yield from`  :(
-                    yield result
-            except StopIteration:
+            if cancelled is not None and cancelled.is_set():
+                LOG.debug("Caller stopped reading results. Stopping dispatch.")
+                return
+
+            exhausted = self._fill(tasks)
+            self._send_chunks()
+
+            if scheduler:
+                LOG.debug("Workers busy. Waiting for results.")
+            elif (not exhausted and
+                  not self._is_window_full() and
+                  len(self._tasks_in_progress) < 2 * self._lookahead()):
+                continue  # Everything read so far was sent. Read more.
+            elif self.is_completed:
                 break
 
-        while not self.is_completed:
-            for result in result_getter():
+            # Wait for results, which may include unprocessed tasks that
+            # need to be re-sent.
+            for result in result_getter():  # I wish I had `yield from`  :(
                 yield result
 
     @lockutils.lock_instance("_lock")
@@ -201,7 +518,10 @@ class ProcessPoolDistributor(object):
             tasks = self._tasks_in_progress
             results = self._task_results_waiting
 
-            for task_id in tasks.keys():
+            # Only look at the oldest task each time rather than copying
+            # every key, since most tasks won't have results yet.
+            while tasks:
+                task_id = next(iter(tasks))
                 if task_id not in results:
                     break
 
@@ -245,6 +565,7 @@ class ProcessPoolDistributor(object):
             yield result
 
     def _kill_process(self, pid, join=False):
+        """Kill the process `pid` and return the slot it was in."""
         LOG.debug("Killing subprocess %s.", pid)
         process = self._processes.pop(pid)
 
@@ -252,15 +573,52 @@ class ProcessPoolDistributor(object):
             process.join()
 
         process.terminate()
+        return self._slots.pop(pid)
+
+    def _stop_processes(self, timeout):
+        """Send a signals.StopProcessing message to each worker and wait up
+        to `timeout` seconds for them to exit, so their teardown can run.
+
+        Any results still on the result queue are discarded. Workers which
+        stopped are removed from the process map.
+        """
+        deadline = time.time() + timeout
+        unsent = sorted(self._slots.values())
+        running = set(self._processes)
+
+        while running and time.time() < deadline:
+            if unsent:
+                try:
+                    self._transport.send_signal(signals.StopProcessing, unsent[-1])
+                    unsent.pop()
+                    continue
+                except Queue.Full:
+                    pass  # Workers are still busy with tasks.
+
+            # Keep reading so workers aren't blocked writing results.
+            for _, message in self._transport.recv(timeout=0.1):
+                if isinstance(message, signals.Stopped):
+                    running.discard(message.pid)
+                    self._slots.pop(message.pid)
+                    self._processes.pop(message.pid).join()
+
+        if running:
+            LOG.warning("%d subprocesses did not stop in time.", len(running))
 
     def _reset(self):
         """Unsets all instance variables that are set up in start()."""
-        self._worker = None
+        self._workers = None
         self._processes = None
-        self._task_queue = None
-        self._result_queue = None
+        self._slots = None
+        self._transport = None
         self._tasks_in_progress = None
         self._task_results_waiting = None
+        self._scheduler = None
+        self._deduplicator = None
+        self._task_shared_arrays = None
+        self._share_owner = None
+        self._init_times = None
+        self._cancelled = None
 
     @lockutils.unlock_instance("_lock")
     def stop(self):
@@ -268,7 +626,35 @@ class ProcessPoolDistributor(object):
         if not self.is_started:
             raise RuntimeError("Cannot call stop() before start()")
 
+        if self._teardown is not None:
+            self._stop_processes(constants.TEARDOWN_TIMEOUT)
+
+        processes = self._processes.values()
+
         for pid in self._processes.keys():
             self._kill_process(pid)
 
-        self._reset()
\ No newline at end of file
+        # The transport can only be closed once every worker has exited.
+        for process in processes:
+            process.join()
+
+        self._transport.close()
+
+        if self._share_threshold is not None:
+            # Remove shared arrays for tasks which never returned.
+            sharedarrays.cleanup(self._share_owner)
+
+        self._reset()
+
+
+def _dedupe_window(dedupe):
+    """Return the deduplication window for the input `dedupe` option, or
+    None if deduplication is disabled.
+    """
+    if dedupe is None or dedupe is False:
+        return None
+    elif dedupe is True:
+        return constants.DEDUPE_WINDOW
+    elif dedupe < 0:
+        raise ValueError("dedupe window must be >= 0")
+    return dedupe
@@ -0,0 +1,198 @@
+"""
+Long-lived pools of worker processes which can be reused across calls to
+``distributed`` and ``@distribute``.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import atexit
+import logging
+import threading
+import collections
+
+from buckshot import lockutils
+from buckshot import constants
+from buckshot.distributors import ProcessPoolDistributor
+
+LOG = logging.getLogger(__name__)
+
+
+def _hashable(value):
+    """Return `value` if it is hashable, otherwise its id()."""
+    try:
+        hash(value)
+    except TypeError:
+        return id(value)
+    return value
+
+
+def _make_key(func, options):
+    """Return the pool key for `func` and its distributor `options`.
+
+    Unhashable options, like a ``context`` dict, are keyed on their id().
+    The pooled distributor keeps a reference to the object, so its id
+    can't be reused while the distributor is in the pool.
+    """
+    items = sorted((k, _hashable(v)) for k, v in options.iteritems())
+    return (func, tuple(items))
+
+
+class DistributorPool(object):
+    """Keeps started ProcessPoolDistributor objects alive between calls so
+    worker processes are not forked and killed every time a distributed
+    function is called.
+
+    Distributors are keyed on the work function and distributor options.
+    They are started lazily the first time they are acquired. A distributor
+    which has not been used for `idle_timeout` seconds is stopped.
+
+    Only distributors which were fully drained are returned to the pool. If
+    a caller stops consuming results early, the distributor is stopped
+    instead so its in-flight tasks cannot leak into the next call.
+
+    Note:
+        Worker processes are forked when the distributor starts, so changes
+        made to global state in the parent after that point are not visible
+        to the workers.
+
+    Args:
+        idle_timeout: Number of seconds a distributor can sit unused before
+            its worker processes are stopped. If None, idle distributors are
+            kept until shutdown() is called.
+    """
+
+    def __init__(self, idle_timeout=constants.POOL_IDLE_TIMEOUT):
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)  # key => [distributor, ...]
+        self._keys = {}  # id(distributor) => key
+        self._timers = {}  # id(distributor) => threading.Timer
+
+    def acquire(self, func, **options):
+        """Return a started ProcessPoolDistributor for `func`. An idle one is
+        reused if available, otherwise a new one is created.
+
+        Args:
+            func: The work function.
+            **options: Keyword arguments for ProcessPoolDistributor.
+        """
+        key = _make_key(func, options)
+
+        with self._lock:
+            idle = self._idle[key]
+
+            if idle:
+                distributor = idle.pop()
+                self._timers.pop(id(distributor)).cancel()
+                LOG.debug("Reusing pooled distributor for %s", func)
+                return distributor
+
+        distributor = ProcessPoolDistributor(func=func, **options)
+        distributor.start()
+
+        with self._lock:
+            self._keys[id(distributor)] = key
+        return distributor
+
+    def release(self, distributor):
+        """Return `distributor` to the pool.
+
+        If the distributor still has tasks in flight or is locked by an
+        unfinished generator, it is stopped instead of being reused.
+        """
+        reusable = (
+            distributor.is_completed and
+            not lockutils.is_locked(distributor, "_lock")
+        )
+
+        with self._lock:
+            key = self._keys.get(id(distributor))
+
+            if key is not None and reusable:
+                self._idle[key].append(distributor)
+                self._schedule_stop(distributor)
+                return
+
+            self._keys.pop(id(distributor), None)
+
+        LOG.debug("Discarding pooled distributor with unfinished tasks.")
+        self._stop(distributor)
+
+    def _schedule_stop(self, distributor):
+        if self._idle_timeout is None:
+            self._timers[id(distributor)] = _NullTimer()
+            return
+
+        timer = threading.Timer(self._idle_timeout, self._expire, args=(distributor,))
+        timer.daemon = True
+        timer.start()
+        self._timers[id(distributor)] = timer
+
+    def _expire(self, distributor):
+        """Stop `distributor` if it is still idle."""
+        with self._lock:
+            key = self._keys.get(id(distributor))
+            idle = self._idle.get(key, [])
+
+            if distributor not in idle:
+                return  # Reacquired before the timer fired.
+
+            idle.remove(distributor)
+            self._timers.pop(id(distributor), None)
+            self._keys.pop(id(distributor), None)
+
+        LOG.info("Stopping idle pooled distributor.")
+        self._stop(distributor)
+
+    def _stop(self, distributor):
+        if distributor.is_started:
+            distributor.stop()
+
+    def shutdown(self):
+        """Stop all idle distributors in the pool."""
+        with self._lock:
+            distributors = [d for idle in self._idle.values() for d in idle]
+            timers = self._timers.values()
+
+            self._idle.clear()
+            self._timers.clear()
+            self._keys.clear()
+
+        # Wait for the timer threads to exit so they aren't left running
+        # during interpreter shutdown.
+        for timer in timers:
+            timer.cancel()
+            timer.join()
+
+        for distributor in distributors:
+            self._stop(distributor)
+
+
+class _NullTimer(object):
+    """Stand-in for a threading.Timer when there is no idle timeout."""
+
+    def cancel(self):
+        pass
+
+    def join(self):
+        pass
+
+
+# Module-level pool used by ``distributed(..., pool=True)``.
+DEFAULT_POOL = DistributorPool()
+atexit.register(DEFAULT_POOL.shutdown)
+
+
+def get_pool(pool):
+    """Return the DistributorPool selected by the input `pool` argument.
+
+    Args:
+        pool: None or False for no pool, True for the module-level pool,
+            or a DistributorPool instance.
+    """
+    if pool is None or pool is False:
+        return None
+    elif pool is True:
+        return DEFAULT_POOL
+    return pool
@@ -0,0 +1,219 @@
+"""
+Objects which hold tasks that have been read from the input but not sent
+yet, and decide which worker slot gets the next chunk of them.
+
+Schedulers work with a transport (see buckshot.transports). Every
+scheduler except FifoScheduler sends chunks to specific slots, so they
+need the ``"pipe"`` transport.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import Queue
+import logging
+import itertools
+import collections
+
+LOG = logging.getLogger(__name__)
+
+ROUND_ROBIN = "round-robin"
+LEAST_OUTSTANDING = "least-outstanding"
+WORK_STEALING = "work-stealing"
+
+
+class FifoScheduler(object):
+    """Sends tasks in input order to whichever worker is free. The
+    transport picks the worker.
+
+    Args:
+        num_slots: The number of worker slots.
+    """
+
+    def __init__(self, num_slots):
+        self._tasks = collections.deque()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def add(self, task):
+        """Add a task which was read from the input."""
+        self._tasks.append(task)
+
+    def requeue(self, tasks, slot):
+        """Put `tasks` which could not be sent, or which were returned
+        unprocessed by the worker in `slot`, ahead of every other task.
+        """
+        self._tasks.extendleft(reversed(tasks))
+
+    def next_slot(self, transport):
+        """Return the slot to send the next chunk to. None means any slot.
+
+        Raises:
+            Queue.Full: If no slot can take a chunk right now.
+        """
+        return None
+
+    def take(self, slot, count):
+        """Remove and return up to `count` tasks to send to `slot`."""
+        tasks = self._tasks
+        return [tasks.popleft() for _ in xrange(min(count, len(tasks)))]
+
+    def sent(self, slot, count):
+        """Record that `count` tasks were sent to `slot`."""
+        pass
+
+    def done(self, slot, count):
+        """Record that results for `count` tasks came back from `slot`."""
+        pass
+
+
+class RoundRobinScheduler(FifoScheduler):
+    """Sends tasks in input order, giving each chunk to the next slot in
+    turn. Slots which are still busy are skipped.
+    """
+
+    def __init__(self, num_slots):
+        super(RoundRobinScheduler, self).__init__(num_slots)
+        self._num_slots = num_slots
+        self._next = 0
+
+    def next_slot(self, transport):
+        num_slots = self._num_slots
+
+        for offset in xrange(num_slots):
+            slot = (self._next + offset) % num_slots
+
+            if transport.is_free(slot):
+                self._next = (slot + 1) % num_slots
+                return slot
+
+        raise Queue.Full()
+
+
+class LeastOutstandingScheduler(FifoScheduler):
+    """Sends tasks in input order, giving each chunk to the free slot with
+    the fewest tasks sent to it whose results have not come back.
+    """
+
+    def __init__(self, num_slots):
+        super(LeastOutstandingScheduler, self).__init__(num_slots)
+        self._outstanding = [0] * num_slots  # Tasks sent to each slot without results.
+
+    def next_slot(self, transport):
+        free = [slot for slot, _ in enumerate(self._outstanding) if transport.is_free(slot)]
+
+        if not free:
+            raise Queue.Full()
+        return min(free, key=self._outstanding.__getitem__)
+
+    def sent(self, slot, count):
+        self._outstanding[slot] += count
+
+    def done(self, slot, count):
+        self._outstanding[slot] -= count
+
+
+class WorkStealingScheduler(FifoScheduler):
+    """Deals tasks out to a deque for each slot as they are read. A slot
+    takes its chunks from the front of its own deque. When its deque is
+    empty, it steals from the back of the longest deque, so a slot which
+    is stuck on a long task doesn't hold on to work that others could do.
+    """
+
+    def __init__(self, num_slots):
+        self._deques = [collections.deque() for _ in xrange(num_slots)]
+        self._deal = itertools.cycle(xrange(num_slots))
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, task):
+        self._deques[self._route(task)].append(task)
+        self._count += 1
+
+    def _route(self, task):
+        """Return the slot whose deque `task` is added to."""
+        return next(self._deal)
+
+    def requeue(self, tasks, slot):
+        self._deques[slot].extendleft(reversed(tasks))
+        self._count += len(tasks)
+
+    def next_slot(self, transport):
+        """Return a free slot, preferring one which has tasks of its own."""
+        idle = None
+
+        for slot, deque in enumerate(self._deques):
+            if not transport.is_free(slot):
+                continue
+            elif deque:
+                return slot
+            elif idle is None:
+                idle = slot
+
+        if idle is None:
+            raise Queue.Full()
+        return idle
+
+    def take(self, slot, count):
+        own = self._deques[slot]
+
+        if own:
+            tasks = [own.popleft() for _ in xrange(min(count, len(own)))]
+        else:
+            victim = max(self._deques, key=len)
+            tasks = [victim.pop() for _ in xrange(min(count, len(victim)))]
+            tasks.reverse()
+
+            if tasks:
+                LOG.debug("Slot %d stole %d tasks", slot, len(tasks))
+
+        self._count -= len(tasks)
+        return tasks
+
+
+class AffinityScheduler(WorkStealingScheduler):
+    """Adds each task to the deque of the slot picked by hashing
+    ``key(*task.args)``, so tasks with the same key go to the same worker.
+    A slot with an empty deque steals from the back of the longest deque,
+    which only happens when that deque's own worker is busy.
+
+    Args:
+        num_slots: The number of worker slots.
+        key: A function called with each task's arguments which returns a
+            hashable key.
+    """
+
+    def __init__(self, num_slots, key):
+        super(AffinityScheduler, self).__init__(num_slots)
+        self._key = key
+
+    def _route(self, task):
+        return hash(self._key(*task.args)) % len(self._deques)
+
+
+_SCHEDULERS = {
+    ROUND_ROBIN: RoundRobinScheduler,
+    LEAST_OUTSTANDING: LeastOutstandingScheduler,
+    WORK_STEALING: WorkStealingScheduler,
+}
+
+SCHEDULES = tuple(sorted(_SCHEDULERS))  # Valid `schedule` names.
+
+
+def get_scheduler(schedule, num_slots, affinity=None):
+    """Return a scheduler for the input `schedule` name, or a FifoScheduler
+    if `schedule` is None. If an `affinity` key function is given, an
+    AffinityScheduler is returned and `schedule` must be None.
+    """
+    if affinity is not None:
+        if schedule is not None:
+            raise ValueError("schedule cannot be combined with affinity")
+        return AffinityScheduler(num_slots, affinity)
+    elif schedule is None:
+        return FifoScheduler(num_slots)
+    elif schedule in _SCHEDULERS:
+        return _SCHEDULERS[schedule](num_slots)
+    raise ValueError("Unknown schedule: %r" % (schedule,))
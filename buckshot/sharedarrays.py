@@ -0,0 +1,143 @@
+"""
+Moves large NumPy arrays between processes through shared memory files
+instead of pickling them through a pipe.
+
+Only a small SharedArray handle travels over the task and result queues.
+The receiving process maps the file, so the array data is not copied again
+on the way in.
+
+NumPy is optional. Without it, nothing is ever shared.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import glob
+import uuid
+import logging
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LOG = logging.getLogger(__name__)
+
+# Files in /dev/shm live in memory. Fall back to the temp directory on
+# systems which don't have it.
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+class SharedArray(object):
+    """A picklable handle to an array stored in a shared memory file."""
+
+    __slots__ = ["path", "shape", "dtype", "order"]
+
+    def __init__(self, path, shape, dtype, order):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+        self.order = order
+
+    def __repr__(self):
+        return "SharedArray(%r, %r, %r)" % (self.path, self.shape, self.dtype)
+
+
+def new_owner():
+    """Return a new owner name for shared files. Names start with the
+    current pid so leftover files can be traced to a process.
+    """
+    return "%d-%s" % (os.getpid(), uuid.uuid4().hex[:12])
+
+
+def _prefix(owner):
+    """Return the path prefix of the shared files owned by `owner`."""
+    return os.path.join(SHM_DIR, "buckshot-%s-" % owner)
+
+
+def _is_shareable(value, threshold):
+    return (
+        numpy is not None and
+        type(value) is numpy.ndarray and
+        value.size > 0 and
+        value.nbytes >= threshold and
+        not value.dtype.hasobject
+    )
+
+
+def share(value, threshold, owner):
+    """Copy `value` into a shared memory file and return a SharedArray
+    handle for it, if it is a NumPy array of at least `threshold` bytes.
+    Otherwise, `value` is returned unchanged.
+
+    The file is named after `owner` (see new_owner()) so cleanup() can
+    find it if the handle is lost. If the file can't be written (e.g., the
+    shared memory filesystem is full), `value` is returned and will be
+    pickled.
+    """
+    if not _is_shareable(value, threshold):
+        return value
+
+    if value.flags.f_contiguous and not value.flags.c_contiguous:
+        order, data = "F", value.T  # C-contiguous view of the same memory.
+    else:
+        order, data = "C", numpy.ascontiguousarray(value)
+
+    path = _prefix(owner) + uuid.uuid4().hex
+
+    try:
+        with open(path, "wb") as f:
+            data.tofile(f)
+    except EnvironmentError as ex:
+        LOG.warning("Could not share %d byte array: %s", value.nbytes, ex)
+        _unlink(path)
+        return value
+
+    # Keep the whole dtype. dtype.str loses the fields of structured arrays.
+    return SharedArray(path, value.shape, value.dtype, order)
+
+
+def attach(value, claim=False):
+    """Return the array for a SharedArray handle. Any other `value` is
+    returned unchanged.
+
+    If `claim` is False, the array is mapped copy-on-write: it can be
+    modified without changing the file, which may be attached again. If
+    True, the file is unlinked after mapping and the array is writable.
+    Either way, the memory is released when the array is garbage collected.
+    """
+    if not isinstance(value, SharedArray):
+        return value
+
+    mode = "r+" if claim else "c"
+    array = numpy.memmap(value.path, dtype=value.dtype, mode=mode,
+                         shape=value.shape, order=value.order)
+
+    if claim:
+        _unlink(value.path)
+
+    # Hand back a plain ndarray. It keeps the mapping alive through .base.
+    return array.view(numpy.ndarray)
+
+
+def release(handles):
+    """Unlink the files for each SharedArray in `handles`. Processes which
+    already attached them keep their mappings.
+    """
+    for handle in handles:
+        _unlink(handle.path)
+
+
+def cleanup(owner):
+    """Unlink every shared file named after `owner`."""
+    for path in glob.glob(_prefix(owner) + "*"):
+        _unlink(path)
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -13,3 +13,13 @@ class Stopped(object):
 
     def __init__(self, pid):
         self.pid = pid
+
+
+class Initialized(object):
+    """Notifies a process manager that a subprocess ran its initializer,
+    which took `duration` seconds.
+    """
+
+    def __init__(self, pid, duration):
+        self.pid = pid
+        self.duration = duration
@@ -2,8 +2,12 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import os
+import copy
+import time
+import itertools
 import collections
 
+from buckshot import errors
 from buckshot import datautils
 
 
@@ -34,6 +38,52 @@ class Result(object):
         return "Result(%r, %r)" % (self.task_id, self.value)
 
 
+class TaskChunk(object):
+    """A batch of Task objects which is sent to a worker as one message.
+
+    `sent` is the time at which the chunk was created, right before it is
+    sent.
+    """
+
+    __slots__ = ["tasks", "sent"]
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.sent = time.time()
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __repr__(self):
+        return "TaskChunk(%r)" % (self.tasks,)
+
+
+class ResultChunk(object):
+    """A batch of Result objects which is returned from a worker as one
+    message.
+
+    If a task in the chunk times out, the worker stops processing the chunk.
+    The tasks which were never attempted are returned in `unprocessed` so
+    they can be sent to another worker.
+
+    `elapsed` is the number of seconds spent executing the tasks and
+    `transit` is the number of seconds the TaskChunk took to reach the
+    worker, not counting time it sat queued while the worker was busy.
+    """
+
+    __slots__ = ["results", "unprocessed", "pid", "elapsed", "transit"]
+
+    def __init__(self, results, unprocessed=None, elapsed=0.0, transit=0.0):
+        self.results = results
+        self.unprocessed = unprocessed or []
+        self.pid = os.getpid()
+        self.elapsed = elapsed
+        self.transit = transit
+
+    def __repr__(self):
+        return "ResultChunk(%r, unprocessed=%r)" % (self.results, self.unprocessed)
+
+
 class TaskIterator(collections.Iterator):
     """Iterator which yields Task objects for the input argument tuples.
 
@@ -47,3 +97,111 @@ class TaskIterator(collections.Iterator):
 
     def next(self):
         return next(self._iter)
+
+    def take(self, count):
+        """Return a list of up to `count` Task objects. An empty list is
+        returned when the iterator is exhausted.
+        """
+        return list(itertools.islice(self._iter, count))
+
+
+class TaskDeduplicator(object):
+    """Tracks the argument tuples of tasks so each distinct input is only
+    sent to a worker once.
+
+    A task whose arguments match a task that is still in flight follows
+    that task and receives a copy of its result. A task whose arguments
+    match one of the last `window` completed tasks is answered right away.
+    Arguments only match if they are equal and of the same types, so 1,
+    1.0 and True are different inputs. Tasks with unhashable arguments
+    are never deduplicated.
+
+    Each follower gets its own deep copy of the result, so a caller which
+    modifies one result doesn't change the others.
+
+    Args:
+        window: The number of completed inputs to remember results for.
+    """
+
+    def __init__(self, window):
+        self._window = window
+        self._leaders = {}  # key => id of the in-flight task for those args.
+        self._followers = {}  # leader task id => (key, [follower task id, ...])
+        self._recent = collections.OrderedDict()  # key => recent result value.
+
+    def add(self, task):
+        """Record `task` and return True if it must be sent to a worker.
+
+        If False is returned, the task either follows an in-flight task
+        or its result is available from recent() immediately.
+        """
+        key = _typed_key(task.args)
+
+        try:
+            leader = self._leaders.get(key)
+        except TypeError:
+            return True  # Unhashable arguments.
+
+        if leader is not None:
+            self._followers[leader][1].append(task.id)
+            return False
+        elif key in self._recent:
+            return False
+
+        self._leaders[key] = task.id
+        self._followers[task.id] = (key, [])
+        return True
+
+    def recent(self, task):
+        """Return a Result for `task` from a recently completed task, or
+        None if there is no such result.
+        """
+        try:
+            value = self._recent[_typed_key(task.args)]
+        except (KeyError, TypeError):
+            return None
+        return Result(task.id, _copy(value))
+
+    def complete(self, result):
+        """Record the `result` of a task which was sent to a worker and
+        return a copy of it for each task which followed it.
+
+        Timed out results are passed to followers, but are not remembered
+        for later tasks.
+        """
+        try:
+            key, followers = self._followers.pop(result.task_id)
+        except KeyError:
+            return []  # Not deduplicated.
+
+        del self._leaders[key]
+
+        if not isinstance(result.value, errors.TaskTimeout) and self._window:
+            # Keep our own copy in case the caller modifies the result.
+            recent = self._recent
+            recent[key] = _copy(result.value)
+
+            if len(recent) > self._window:
+                recent.popitem(last=False)
+
+        return [Result(task_id, _copy(result.value)) for task_id in followers]
+
+
+# Types whose values can be handed to several callers without copying.
+_IMMUTABLE_TYPES = frozenset([int, long, float, complex, bool, str, unicode, type(None)])
+
+
+def _typed_key(value):
+    """Return a key for `value` which only matches equal values of the
+    same types, e.g., 1 and 1.0 (which are equal) get different keys.
+    """
+    if type(value) is tuple:
+        return tuple(_typed_key(x) for x in value)
+    return type(value), value
+
+
+def _copy(value):
+    """Return a deep copy of `value`, unless it is immutable."""
+    if type(value) in _IMMUTABLE_TYPES:
+        return value
+    return copy.deepcopy(value)
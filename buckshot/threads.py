@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import Queue
 import logging
 import threading
 
@@ -48,3 +49,127 @@ def isolated(target, daemon=False, timeout=None):
         return result
 
     return inner
+
+
+class Executor(object):
+    """Runs the target function in one long-lived thread.
+
+    Unlike ``isolated``, a thread is not created for every call. A new
+    thread is only started if the previous one timed out, since there is
+    no way to stop a thread which is still running.
+
+    Exceptions raised by the target function are re-raised in the caller.
+
+    Args:
+        target: The function to execute.
+        daemon: If True, daemonize the thread.
+        timeout: The maximum allowable time a call can spend executing.
+            If None, there is no timeout.
+    """
+
+    def __init__(self, target, daemon=False, timeout=None):
+        self._target = target
+        self._daemon = daemon
+        self._timeout = timeout
+        self._thread = None
+        self._inbox = None
+        self._outbox = None
+
+    def _run(self, inbox, outbox):
+        """Thread loop: call the target for each args tuple received."""
+        while True:
+            args = inbox.get()
+
+            try:
+                outbox.put((True, self._target(*args)))
+            except Exception as ex:
+                outbox.put((False, ex))
+
+    def _start(self):
+        self._inbox = Queue.Queue()
+        self._outbox = Queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(self._inbox, self._outbox)
+        )
+        self._thread.daemon = self._daemon
+        self._thread.start()
+
+    def __call__(self, *args):
+        if self._thread is None:
+            self._start()
+
+        self._inbox.put(args)
+
+        try:
+            success, value = self._outbox.get(timeout=self._timeout)
+        except Queue.Empty:
+            self._thread = None  # Abandon the busy thread.
+            raise ThreadTimeout("Thread timed out.")
+
+        if not success:
+            raise value
+        return value
+
+
+class _Done(object):
+    """Marks the end of a readahead() buffer."""
+    pass
+
+
+def readahead(iterable, size, cancelled=None):
+    """Iterate over `iterable` in a background thread and yield its items,
+    buffering up to `size` items which the caller has not consumed yet.
+
+    The background thread blocks while the buffer is full, so memory use
+    is bounded by `size`. Exceptions raised by `iterable` are re-raised in
+    the caller. If the caller stops iterating early, the `cancelled` Event
+    is set, the background thread stops after its current item and
+    `iterable` is closed. The caller waits for that, so an `iterable`
+    which can block for a long time between items should check
+    `cancelled` while it waits.
+    """
+    buffer = Queue.Queue(maxsize=size)
+
+    if cancelled is None:
+        cancelled = threading.Event()
+
+    def put(item):
+        """Put `item` in the buffer unless the caller has gone away."""
+        while not cancelled.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception as ex:
+            put((False, ex))
+        else:
+            put((True, _Done))
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            success, value = buffer.get()
+
+            if not success:
+                raise value
+            elif value is _Done:
+                break
+            yield value
+    finally:
+        cancelled.set()
+        thread.join()
@@ -0,0 +1,311 @@
+"""
+Channels which carry task chunks from the parent process to its workers
+and results back.
+
+Every transport assigns each worker a slot: a stable index which a worker
+started to replace a timed out one takes over.
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import Queue
+import select
+import logging
+import threading
+import collections
+import multiprocessing
+import multiprocessing.util
+
+from buckshot.tasks import ResultChunk
+
+LOG = logging.getLogger(__name__)
+
+QUEUE = "queue"  # All workers share one task queue and one result queue.
+PIPE = "pipe"  # Each worker has its own duplex Pipe.
+
+
+class QueueTransport(object):
+    """All workers read task chunks from one shared queue and write results
+    to one shared queue. The first idle worker takes the next chunk.
+
+    Args:
+        num_slots: The number of worker slots.
+        prefetch: The number of chunks which can be queued per worker.
+    """
+
+    def __init__(self, num_slots, prefetch=1):
+        self._tasks = multiprocessing.Queue(maxsize=num_slots * prefetch)
+
+        # Workers block on a full result queue until we read from it, so
+        # results can't pile up in the queue's pipe and feeder buffers.
+        self._results = multiprocessing.Queue(maxsize=num_slots * (prefetch + 1))
+
+    def channels(self, slot):
+        """Return the (input, output) queues for the worker in `slot`."""
+        return self._tasks, self._results
+
+    def send(self, message, slot=None):
+        """Put `message` on the task queue. `slot` is ignored, since any
+        worker can take it.
+
+        Raises:
+            Queue.Full: If the task queue is full.
+        """
+        self._tasks.put_nowait(message)
+
+    def send_signal(self, signal, slot):
+        """Put a signal on the task queue. The first worker to read it
+        handles it, whatever its slot.
+
+        Raises:
+            Queue.Full: If the task queue is full.
+        """
+        self._tasks.put_nowait(signal)
+
+    def close(self):
+        """Nothing to do. The queues are closed when they are garbage
+        collected.
+        """
+        pass
+
+    def recv(self, timeout=None):
+        """Yield a (slot, message) tuple for each message on the result
+        queue. The slot is always None.
+
+        Wait up to `timeout` seconds for the first message (forever if
+        None). The rest are only yielded if they are ready.
+        """
+        try:
+            yield None, self._results.get(block=timeout != 0, timeout=timeout)
+        except Queue.Empty:
+            return
+
+        while True:
+            try:
+                message = self._results.get_nowait()
+            except Queue.Empty:
+                break
+            yield None, message
+
+
+class PipeTransport(object):
+    """Each worker has its own duplex Pipe. The parent waits on all of them
+    at once with poll() (or select() where poll() is not available) and
+    sends each chunk to a specific worker.
+
+    The worker end of each Pipe is kept open in the parent so a worker
+    started to replace a timed out one can take over its slot, including
+    any chunks already sent to it.
+
+    Messages are written by a feeder thread for each slot. A chunk which
+    doesn't fit in the pipe's buffer then can't block the parent until a
+    busy worker gets around to reading it.
+
+    Args:
+        num_slots: The number of worker slots.
+        prefetch: The number of chunks which can be sent to a worker before
+            it has returned the results of the first.
+    """
+
+    def __init__(self, num_slots, prefetch=1):
+        self._prefetch = prefetch
+        self._pipes = [multiprocessing.Pipe() for _ in xrange(num_slots)]
+        self._feeders = [None] * num_slots  # Started on the first send to each slot.
+        self._outstanding = [0] * num_slots  # Chunks sent to each slot without results.
+
+        # One entry for each chunk a slot can take before it is full, in the
+        # order the slots became free.
+        self._free = collections.deque(slot for _ in xrange(prefetch) for slot in xrange(num_slots))
+        self._slots = dict((conn.fileno(), slot) for slot, (conn, _) in enumerate(self._pipes))
+
+        if hasattr(select, "poll"):
+            self._poller = select.poll()
+            for fd in self._slots:
+                self._poller.register(fd, select.POLLIN)
+        else:
+            self._poller = None
+
+    def channels(self, slot):
+        """Return the (input, output) channels for the worker in `slot`."""
+        channel = _PipeChannel(self._pipes[slot][1])
+        return channel, channel
+
+    def outstanding(self, slot):
+        """Return the number of chunks sent to `slot` whose results have not
+        been received.
+        """
+        return self._outstanding[slot]
+
+    def is_free(self, slot):
+        """Return True if the worker in `slot` can take another chunk."""
+        return self._outstanding[slot] < self._prefetch
+
+    def send(self, message, slot=None):
+        """Send `message` to the worker in `slot`. If `slot` is None, the
+        worker which most recently became free is used, since it is the
+        most likely to still be running and have warm caches.
+
+        Raises:
+            Queue.Full: If every worker (or the worker in `slot`) already
+                has `prefetch` chunks outstanding.
+        """
+        if slot is None:
+            try:
+                slot = self._free.pop()
+            except IndexError:
+                raise Queue.Full()
+        elif self._outstanding[slot] < self._prefetch:
+            self._free.remove(slot)
+        else:
+            raise Queue.Full()
+
+        self._feeder(slot).put(message)
+        self._outstanding[slot] += 1
+
+    def send_signal(self, signal, slot):
+        """Send a signal to the worker in `slot`. Signals are not counted
+        as outstanding chunks.
+        """
+        self._feeder(slot).put(signal)
+
+    def _feeder(self, slot):
+        feeder = self._feeders[slot]
+
+        if feeder is None:
+            feeder = self._feeders[slot] = _Feeder(self._pipes[slot][0])
+        return feeder
+
+    def close(self):
+        """Stop the feeder threads and close the pipes. Must only be called
+        once every worker has exited.
+
+        Messages which have not been sent are dropped. Closing the worker
+        ends first makes a feeder blocked writing to a full pipe fail
+        instead of waiting forever.
+        """
+        for feeder, (conn, worker_conn) in zip(self._feeders, self._pipes):
+            worker_conn.close()
+
+            if feeder is not None:
+                feeder.close()
+                feeder.join()
+
+            conn.close()
+
+    def _ready(self, timeout):
+        """Return the slots with messages waiting, after waiting up to
+        `timeout` seconds (forever if None) for one to arrive.
+        """
+        if self._poller is not None:
+            events = self._poller.poll(None if timeout is None else timeout * 1000)
+            return [self._slots[fd] for fd, _ in events]
+
+        ready, _, _ = select.select(list(self._slots), [], [], timeout)
+        return [self._slots[fd] for fd in ready]
+
+    def recv(self, timeout=None):
+        """Yield a (slot, message) tuple for each message sent by a worker.
+
+        Wait up to `timeout` seconds for the first message (forever if
+        None). The rest are only yielded if they are ready.
+        """
+        ready = self._ready(timeout)
+
+        while ready:
+            for slot in ready:
+                conn = self._pipes[slot][0]
+
+                while conn.poll():
+                    message = conn.recv()
+                    if isinstance(message, ResultChunk):
+                        self._outstanding[slot] -= 1
+                        self._free.append(slot)
+                    yield slot, message
+
+            ready = self._ready(0)
+
+
+class _Close(object):
+    """Tells a _Feeder thread to exit."""
+    pass
+
+
+class _Feeder(object):
+    """Sends messages on a Connection from a background thread, so putting
+    a message never blocks on a full pipe. Messages are sent in order.
+    """
+
+    def __init__(self, conn):
+        self._buffer = Queue.Queue()
+        self._thread = threading.Thread(target=self._feed, args=(conn, self._buffer))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, message):
+        self._buffer.put(message)
+
+    def close(self):
+        """Tell the thread to exit after sending the messages already put."""
+        self._buffer.put(_Close)
+
+    def join(self):
+        self._thread.join()
+
+    @staticmethod
+    def _feed(conn, buffer):
+        while True:
+            message = buffer.get()
+            if message is _Close:
+                break
+
+            try:
+                conn.send(message)
+            except (IOError, OSError):
+                LOG.debug("Pipe closed. Dropping unsent messages.")
+                break
+
+
+class _PipeChannel(object):
+    """Queue-like wrapper around the worker end of a Pipe, so a TaskWorker
+    can use it in place of a multiprocessing.Queue.
+
+    Like multiprocessing.Queue, put() hands messages to a feeder thread.
+    The worker can then go back to reading chunks while a large result is
+    still being written, so neither side can block the other forever. The
+    feeder is started on the first put(), after the worker has been forked,
+    and is flushed when the worker process exits.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._feeder = None
+
+    def get(self):
+        return self._conn.recv()
+
+    def put(self, message):
+        if self._feeder is None:
+            self._feeder = _Feeder(self._conn)
+            multiprocessing.util.Finalize(
+                self, _PipeChannel._flush,
+                args=(self._feeder,),
+                exitpriority=-5
+            )
+        self._feeder.put(message)
+
+    @staticmethod
+    def _flush(feeder):
+        feeder.close()
+        feeder.join()
+
+
+def get_transport(transport, num_slots, prefetch=1):
+    """Return a new transport for the input `transport` name, which is
+    either ``"queue"`` or ``"pipe"``.
+    """
+    if transport == QUEUE:
+        return QueueTransport(num_slots, prefetch)
+    elif transport == PIPE:
+        return PipeTransport(num_slots, prefetch)
+    raise ValueError("Unknown transport: %r" % (transport,))
@@ -2,15 +2,33 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import os
+import time
 import logging
 
 from buckshot import errors
 from buckshot import signals
 from buckshot import tasks
 from buckshot import threads
+from buckshot import sharedarrays
 
 LOG = logging.getLogger(__name__)
 
+# The context object of the TaskWorker running in this process.
+_context = None
+
+
+def get_context():
+    """Return the `context` object passed to ``distributed`` or
+    ``@distribute`` for the work function running in this process.
+
+    Worker processes inherit the context when they are forked, so it is
+    never pickled. Treat it as read-only: changes made in a worker are not
+    seen by the parent or by other workers.
+
+    Returns None outside of a worker process or if no context was given.
+    """
+    return _context
+
 
 class Suicide(Exception):
     """Raised when a Listener kills itself."""
@@ -18,23 +36,58 @@ class Suicide(Exception):
 
 
 class TaskWorker(object):
-    """Listens for tasks on an input queue, passes the task to the worker
-    function, and returns the results on the output queue.
+    """Listens for task chunks on an input queue, passes each task to the
+    worker function, and returns the results for the chunk on the output
+    queue.
 
     If we receive a signals.StopProcessing object, we send back our process
     id and die.
 
-    If a task times out, send back a errors.TaskTimeout object.
+    If a task times out, send back a errors.TaskTimeout object along with
+    any tasks in the chunk which were not processed. If a task raises an
+    exception, send back a errors.SubprocessError object as its result.
+
+    The worker function is called directly when there is no timeout. When a
+    timeout is set, tasks run in a threads.Executor thread which is reused
+    between tasks.
+
+    If `share_threshold` is not None, sharedarrays.SharedArray arguments
+    are attached before calling the worker function, and NumPy array
+    results of at least `share_threshold` bytes are returned through
+    shared memory. Result files are named after `share_owner` so the
+    parent can clean up any that are never received.
+
+    The `context` object is made available to the worker function through
+    get_context() once the worker starts.
+
+    If an `initializer` is given, it is called with `initargs` when the
+    worker starts, before any tasks are received. Its run time is sent back
+    in a signals.Initialized message. If it raises, an errors.SubprocessError
+    is sent back and the worker exits. The `teardown` function is called
+    when a signals.StopProcessing message is received. It is not called
+    when a worker exits after a task timeout.
     """
 
-    def __init__(self, func, input_queue, output_queue, timeout=None):
+    def __init__(self, func, input_queue, output_queue, timeout=None,
+                 share_threshold=None, share_owner=None, context=None,
+                 initializer=None, initargs=(), teardown=None):
         self._input_queue = input_queue
         self._output_queue = output_queue
-        self._thread_func = threads.isolated(
-            target=func,
-            daemon=True,
-            timeout=timeout
-        )
+        self._context = context
+        self._initializer = initializer
+        self._initargs = initargs
+        self._teardown = teardown
+        self._share_threshold = share_threshold
+        self._share_owner = share_owner or sharedarrays.new_owner()
+
+        if timeout is None:
+            self._call = func  # No thread is needed without a timeout.
+        else:
+            self._call = threads.Executor(
+                target=func,
+                daemon=True,
+                timeout=timeout
+            )
 
     def _recv(self):
         """Get a message off of the input queue. Block until something is
@@ -42,12 +95,12 @@ class TaskWorker(object):
 
         If a signals.StopProcessing message is received, die.
         """
-        task = self._input_queue.get()
+        chunk = self._input_queue.get()
 
-        if task is signals.StopProcessing:
+        if chunk is signals.StopProcessing:
             self._die()
 
-        return task
+        return chunk
 
     def _send(self, result):
         """Put the `value` on the output queue."""
@@ -59,32 +112,101 @@ class TaskWorker(object):
         a Suicide exception.
         """
         LOG.debug("Received StopProcessing")
+
+        if self._teardown is not None:
+            try:
+                self._teardown()
+            except Exception:
+                LOG.exception("Worker teardown raised an exception")
+
         self._send(signals.Stopped(os.getpid()))
         raise Suicide()
 
+    def _initialize(self):
+        """Call the initializer and send back a signals.Initialized message
+        with the time it took.
+        """
+        start = time.time()
+        self._initializer(*self._initargs)
+        duration = time.time() - start
+
+        LOG.debug("Worker %d initialized in %.3f seconds", os.getpid(), duration)
+        self._send(signals.Initialized(os.getpid(), duration))
+
+    def _call_shared(self, args):
+        """Call the worker function with shared arrays attached and share
+        the result if it is a large array.
+        """
+        threshold = self._share_threshold
+        result = self._call(*[sharedarrays.attach(arg) for arg in args])
+        return sharedarrays.share(result, threshold, self._share_owner)
+
     def _process_task(self, task):
         try:
             LOG.info("%s starting task %s", os.getpid(), task.id)
-            success, result = True, self._thread_func(*task.args)
+
+            if self._share_threshold is None:
+                success, result = True, self._call(*task.args)
+            else:
+                success, result = True, self._call_shared(task.args)
         except threads.ThreadTimeout:
             LOG.error("Task %s timed out", task.id)
             success, result = False, errors.TaskTimeout(task)
+        except Exception as ex:
+            LOG.exception("Task %s raised an exception", task.id)
+            success, result = True, errors.SubprocessError(ex)
         return success, tasks.Result(task.id, result)
 
+    def _process_chunk(self, chunk, transit=0.0):
+        """Process each task in the input `chunk`. If a task times out, stop
+        processing and return the remaining tasks as unprocessed. `transit`
+        is passed back on the ResultChunk.
+        """
+        results = []
+        start = time.time()
+
+        for index, task in enumerate(chunk.tasks):
+            success, result = self._process_task(task)
+            results.append(result)
+
+            if not success:
+                unprocessed = chunk.tasks[index + 1:]
+                elapsed = time.time() - start
+                return False, tasks.ResultChunk(results, unprocessed, elapsed, transit)
+
+        elapsed = time.time() - start
+        return True, tasks.ResultChunk(results, elapsed=elapsed, transit=transit)
+
     def __call__(self, *args):
         """Listen for values on the input queue, hand them off to the worker
         function, and send results across the output queue.
         """
+        global _context
+        _context = self._context
+
+        if self._initializer is not None:
+            try:
+                self._initialize()
+            except Exception as ex:
+                LOG.exception("Worker initializer raised an exception")
+                self._send(errors.SubprocessError(ex))
+                return
+
         continue_ = True
 
         while continue_:
+            waiting = time.time()
+
             try:
-                task = self._recv()
+                chunk = self._recv()
             except Suicide:
                 return
             except Exception as ex:
                 retval = errors.SubprocessError(ex)
             else:
-                continue_, retval = self._process_task(task)
+                # Only count the time since we asked for the chunk, so time
+                # it spent queued behind earlier chunks isn't counted as IPC.
+                transit = max(time.time() - max(chunk.sent, waiting), 0.0)
+                continue_, retval = self._process_chunk(chunk, transit)
             self._send(retval)
 
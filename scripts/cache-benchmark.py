@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""
+Measure LRUCache get() latency for caches of different sizes. Lookup cost
+should be flat regardless of the number of entries.
+
+Usage: cache-benchmark.py [size ...]
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import sys
+import time
+import random
+import logging
+
+from buckshot import caches
+
+
+SIZES = [256, 10000, 1000000]
+LOOKUPS = 10000
+
+
+def fill(cache, size):
+    for key in xrange(size):
+        cache[key] = key
+
+
+def benchmark(size):
+    cache = caches.LRUCache(size=size)
+    fill(cache, size)
+
+    keys = [random.randrange(size) for _ in xrange(LOOKUPS)]
+
+    start = time.time()
+    for key in keys:
+        cache[key]
+    duration = time.time() - start
+
+    return duration / LOOKUPS
+
+
+def main():
+    sizes = [int(x) for x in sys.argv[1:] if not x.startswith("-")] or SIZES
+
+    for size in sizes:
+        latency = benchmark(size)
+        print("%9d entries: %8.1f us/get" % (size, latency * 1e6))
+
+
+if __name__ == "__main__":
+    if "-d" in sys.argv:
+        logging.basicConfig(level=logging.DEBUG)
+    main()
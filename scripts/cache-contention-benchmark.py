@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Measure memoized lookup throughput as the number of worker processes grows,
+comparing a single LRUCache against ShardedLRUCache objects hosted in one
+server process and spread across one server process per CPU.
+
+Usage: cache-contention-benchmark.py [workers ...]
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import sys
+import time
+import logging
+import functools
+
+from buckshot import caches
+from buckshot import constants
+from buckshot import distributed
+
+
+WORKERS = [1, 2, 4, 8, 16, 32]
+KEYS = 1000
+LOOKUPS_PER_TASK = 500
+TASKS_PER_WORKER = 4
+
+
+def hammer(cache, seed):
+    for x in xrange(LOOKUPS_PER_TASK):
+        cache.get((seed + x) % KEYS)
+    return LOOKUPS_PER_TASK
+
+
+def benchmark(cache, workers):
+    func = functools.partial(hammer, cache)
+    seeds = range(workers * TASKS_PER_WORKER)
+
+    with distributed(func, processes=workers, ordered=False) as f:
+        start = time.time()
+        lookups = sum(f(seeds))
+        duration = time.time() - start
+
+    return lookups / duration
+
+
+def main():
+    workers = [int(x) for x in sys.argv[1:] if not x.startswith("-")] or WORKERS
+
+    servers = min(constants.CPU_COUNT, caches.DEFAULT_CACHE_SHARDS)
+    contenders = [
+        ("LRUCache", caches.LRUCache(size=KEYS)),
+        ("Sharded (1 server)", caches.ShardedLRUCache(size=KEYS)),
+        ("Sharded (%d servers)" % servers, caches.ShardedLRUCache(size=KEYS, servers=servers)),
+    ]
+
+    for _, cache in contenders:
+        for key in xrange(KEYS):
+            cache[key] = key
+
+    print("%7s   %s" % ("workers", "   ".join("%20s" % name for name, _ in contenders)))
+    for count in workers:
+        rates = [benchmark(cache, count) for _, cache in contenders]
+        print("%7d   %s" % (count, "   ".join("%14.0f ops/s" % rate for rate in rates)))
+
+
+if __name__ == "__main__":
+    if "-d" in sys.argv:
+        logging.basicConfig(level=logging.DEBUG)
+    main()
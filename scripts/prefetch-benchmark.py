@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Measure task throughput as the number of task messages queued per worker
+(``prefetch``) grows, for short and long tasks.
+
+Usage: prefetch-benchmark.py [prefetch ...]
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import sys
+import time
+import logging
+
+from buckshot import constants
+from buckshot import distributed
+
+
+PREFETCH = [1, 2, 4, 8, 16]
+WORKLOADS = [
+    # (name, seconds per task, number of tasks)
+    ("short (10us)", 0.00001, 20000),
+    ("long (5ms)", 0.005, 1000),
+]
+
+
+def spin(seconds):
+    """Busy wait for `seconds` so the task uses CPU like real work."""
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+    return seconds
+
+
+def benchmark(seconds, count, prefetch):
+    with distributed(spin, ordered=False, prefetch=prefetch) as f:
+        start = time.time()
+        for _ in f([seconds] * count):
+            pass
+        duration = time.time() - start
+
+    return count / duration
+
+
+def main():
+    depths = [int(x) for x in sys.argv[1:] if not x.startswith("-")] or PREFETCH
+
+    print("%d worker processes" % constants.CPU_COUNT)
+    print("%8s   %s" % ("prefetch", "   ".join("%18s" % name for name, _, _ in WORKLOADS)))
+    for prefetch in depths:
+        rates = [benchmark(seconds, count, prefetch) for _, seconds, count in WORKLOADS]
+        print("%8d   %s" % (prefetch, "   ".join("%12.0f tasks/s" % rate for rate in rates)))
+
+
+if __name__ == "__main__":
+    if "-d" in sys.argv:
+        logging.basicConfig(level=logging.DEBUG)
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Measure small task throughput with the shared queue transport and the
+per-worker pipe transport as the number of worker processes grows.
+
+Usage: transport-benchmark.py [workers ...]
+"""
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from __future__ import print_function
+
+import sys
+import time
+import logging
+
+from buckshot import distributed
+
+
+WORKERS = [4, 16, 64]
+TRANSPORTS = ["queue", "pipe"]
+TASKS = 20000
+
+
+def identity(x):
+    return x
+
+
+def benchmark(transport, workers):
+    with distributed(identity, processes=workers, ordered=False, transport=transport) as f:
+        start = time.time()
+        for _ in f(xrange(TASKS)):
+            pass
+        duration = time.time() - start
+
+    return TASKS / duration
+
+
+def main():
+    workers = [int(x) for x in sys.argv[1:] if not x.startswith("-")] or WORKERS
+
+    print("%7s   %s" % ("workers", "   ".join("%16s" % name for name in TRANSPORTS)))
+    for count in workers:
+        rates = [benchmark(transport, count) for transport in TRANSPORTS]
+        print("%7d   %s" % (count, "   ".join("%10.0f tasks/s" % rate for rate in rates)))
+
+
+if __name__ == "__main__":
+    if "-d" in sys.argv:
+        logging.basicConfig(level=logging.DEBUG)
+    main()
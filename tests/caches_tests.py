@@ -0,0 +1,551 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import gc
+import time
+import shutil
+import logging
+import unittest
+import tempfile
+import threading
+import functools
+
+from buckshot import caches
+from buckshot import distributed
+
+LOG = logging.getLogger(__name__)
+
+
+def read_cache(cache, key):
+    return cache.get(key)
+
+
+def write_cache(cache, key):
+    cache[key] = key * 2
+
+
+def dump_path(test):
+    """Return a path in a temporary directory which is removed after `test`."""
+    dirname = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, dirname)
+    return os.path.join(dirname, "cache.dump")
+
+
+class LRUCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = caches.LRUCache(size=3)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_put(self):
+        self.cache["a"] = 1
+        self.assertEqual(self.cache["a"], 1)
+        self.assertRaises(KeyError, self.cache.get, "b")
+
+    def test_eviction(self):
+        """Test that the least recently used key is evicted."""
+        for key in "abc":
+            self.cache[key] = key
+
+        self.cache.get("a")  # "b" is now the least recently used.
+        self.cache["d"] = "d"
+
+        self.assertEqual(self.cache.keys(), ["d", "a", "c"])
+        self.assertEqual(self.cache.values(), ["d", "a", "c"])
+        self.assertEqual(len(self.cache), 3)
+
+    def test_update_existing(self):
+        """Test that re-putting a key does not grow the cache."""
+        for _ in range(5):
+            self.cache["a"] = 1
+
+        self.assertEqual(len(self.cache), 1)
+
+    def test_shared_with_workers(self):
+        """Test that worker processes see values put by the parent."""
+        self.cache["a"] = 1
+
+        func = functools.partial(read_cache, self.cache)
+
+        with distributed(func, processes=2) as f:
+            results = list(f(["a"] * 4))
+
+        self.assertEqual(results, [1] * 4)
+
+    def test_stats(self):
+        """Test the stats counters, including lookups from workers."""
+        for key in "abcd":
+            self.cache[key] = key
+
+        self.cache.get("d")
+        self.assertRaises(KeyError, self.cache.get, "a")
+
+        func = functools.partial(read_cache, self.cache)
+        with distributed(func, processes=2) as f:
+            list(f(["d"] * 4))
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 5)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["inserts"], 4)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["size"], 3)
+        self.assertTrue(sum(count for _, count in stats["latency"]) >= 1)
+
+    def test_max_bytes(self):
+        """Test that items are evicted to stay under max_bytes."""
+        cache = caches.LRUCache(size=100, max_bytes=2500)
+
+        for key in range(5):
+            cache[key] = "x" * 1000
+
+        self.assertEqual(cache.keys(), [4, 3])
+        self.assertTrue(cache.stats()["bytes"] <= 2500)
+
+        cache["big"] = "x" * 5000  # Larger than the whole cache.
+        self.assertRaises(KeyError, cache.get, "big")
+        self.assertEqual(len(cache), 2)
+
+        # An oversized put replaces the old value rather than keeping it.
+        cache[4] = "x" * 5000
+        self.assertRaises(KeyError, cache.get, 4)
+        self.assertEqual(cache.keys(), [3])
+
+    def test_close(self):
+        """Test that close() frees the storage in the cache service."""
+        cache = caches.LRUCache(name="closed")
+        cache["a"] = 1
+        cache.close()
+
+        self.assertEqual(len(caches.LRUCache(name="closed")), 0)
+
+    def test_release_on_collect(self):
+        """Test that the storage of an unnamed cache is freed when the
+        cache is garbage collected.
+        """
+        cache = caches.LRUCache()
+        cache["a"] = 1
+        name = cache._name
+
+        del cache
+        gc.collect()
+
+        self.assertEqual(len(caches.LRUCache(name=name)), 0)
+
+    def test_ttl(self):
+        """Test that items expire after their time-to-live."""
+        cache = caches.LRUCache(ttl=0.1)
+        cache["a"] = 1
+        cache.put("b", 2, ttl=60)
+
+        self.assertEqual(cache["a"], 1)
+        time.sleep(0.2)
+
+        self.assertRaises(KeyError, cache.get, "a")
+        self.assertEqual(cache["b"], 2)
+
+        cache["c"] = 3
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_ttl_purge(self):
+        """Test that expired items are purged without being looked up."""
+        cache = caches.LRUCache(ttl=0.1)
+        for key in range(10):
+            cache[key] = key
+
+        time.sleep(0.2)
+        cache.put("new", 1, ttl=60)
+
+        self.assertEqual(cache.keys(), ["new"])
+        self.assertEqual(cache.stats()["expirations"], 10)
+
+    def test_many(self):
+        """Test bulk get_many() and put_many()."""
+        self.cache.put_many([("a", 1), ("b", 2)])
+
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_dump_load(self):
+        """Test that load() restores the items and their recency order."""
+        path = dump_path(self)
+        for key in "abc":
+            self.cache[key] = key * 2
+        self.cache.get("a")
+        self.cache.dump(path)
+
+        cache = caches.LRUCache(size=3)
+        cache.load(path)
+
+        self.assertEqual(cache.keys(), ["a", "c", "b"])
+        self.assertEqual(cache["b"], "bb")
+        self.assertEqual(cache.stats()["inserts"], 3)
+
+    def test_dump_load_ttl(self):
+        """Test that loaded items keep their remaining time-to-live."""
+        path = dump_path(self)
+        self.cache.put("a", 1, ttl=0.2)
+        self.cache.put("b", 2, ttl=60)
+        self.cache.dump(path)
+
+        time.sleep(0.3)
+        cache = caches.LRUCache(size=3)
+        cache.load(path)
+
+        self.assertEqual(cache.keys(), ["b"])
+
+    def test_named(self):
+        """Test that caches with the same name share storage."""
+        other = caches.LRUCache(name=self.cache._name)
+        other["a"] = 1
+        self.assertEqual(self.cache["a"], 1)
+
+    def test_single_service(self):
+        """Test that every cache is hosted by one service."""
+        a, b = caches.LRUCache(), caches.LRUCache()
+        a["x"], b["x"] = 1, 2
+
+        self.assertEqual((a["x"], b["x"]), (1, 2))
+        self.assertTrue(a._store._manager is b._store._manager)
+
+
+class ShardedLRUCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = caches.ShardedLRUCache(size=8, shards=4)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_put(self):
+        for key in range(8):
+            self.cache[key] = key * 2
+
+        self.assertEqual([self.cache[key] for key in range(8)], [x * 2 for x in range(8)])
+        self.assertRaises(KeyError, self.cache.get, 100)
+
+    def test_close(self):
+        cache = caches.ShardedLRUCache(size=8, shards=4, name="closed")
+        cache.put_many((key, key) for key in range(8))
+        cache.close()
+
+        self.assertEqual(len(caches.ShardedLRUCache(size=8, shards=4, name="closed")), 0)
+
+    def test_eviction(self):
+        """Test that each shard evicts its own least recently used keys."""
+        for key in range(100):
+            self.cache[key] = key
+
+        self.assertEqual(len(self.cache), 8)
+        self.assertEqual(self.cache[99], 99)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["inserts"], 100)
+        self.assertEqual(stats["evictions"], 92)
+        self.assertEqual(stats["size"], 8)
+
+    def test_dump_load(self):
+        path = dump_path(self)
+        self.cache.put_many((key, key * 2) for key in range(8))
+        self.cache.dump(path)
+
+        cache = caches.ShardedLRUCache(size=8, shards=2)
+        cache.load(path)
+
+        self.assertEqual(cache.get_many(range(8)), dict((key, key * 2) for key in range(8)))
+
+    def test_many(self):
+        """Test bulk get_many() and put_many() across shards."""
+        self.cache.put_many((key, key * 2) for key in range(8))
+        found = self.cache.get_many(range(10))
+
+        self.assertEqual(found, dict((key, key * 2) for key in range(8)))
+
+
+class SharedMemoryCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = caches.SharedMemoryCache(slots=16, slot_size=128, ways=4)
+
+    def test_get_put(self):
+        self.cache["a"] = 1
+        self.cache[("b", 2)] = [1, 2, 3]
+
+        self.assertEqual(self.cache["a"], 1)
+        self.assertEqual(self.cache[("b", 2)], [1, 2, 3])
+        self.assertRaises(KeyError, self.cache.get, "c")
+
+    def test_dump_load(self):
+        path = dump_path(self)
+        self.cache["a"] = 1
+        self.cache[("b", 2)] = [1, 2, 3]
+        self.cache.dump(path)
+
+        cache = caches.SharedMemoryCache(slots=16, slot_size=128, ways=4)
+        cache.load(path)
+
+        self.assertEqual(cache["a"], 1)
+        self.assertEqual(cache[("b", 2)], [1, 2, 3])
+
+    def test_overwrite(self):
+        self.cache["a"] = 1
+        self.cache["a"] = 2
+
+        self.assertEqual(self.cache["a"], 2)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_overwrite_too_large(self):
+        """Test that a value too large for a slot removes the old value."""
+        self.cache["a"] = 1
+        self.cache["a"] = "x" * 1000
+
+        self.assertRaises(KeyError, self.cache.get, "a")
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_eviction(self):
+        """Test that the cache never holds more items than it has slots."""
+        for key in range(100):
+            self.cache[key] = key
+
+        self.assertEqual(len(self.cache), 16)
+        self.assertEqual(self.cache[99], 99)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["inserts"], 100)
+        self.assertEqual(stats["evictions"], 84)
+        self.assertEqual(stats["size"], 16)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["latency"][0][1], 1)
+
+    def test_too_large(self):
+        """Test that items larger than a slot are silently skipped."""
+        self.cache["a"] = "x" * 1000
+        self.assertRaises(KeyError, self.cache.get, "a")
+
+    def test_shared_with_workers(self):
+        """Test that values written by workers are visible to the parent."""
+        func = functools.partial(write_cache, self.cache)
+
+        with distributed(func, processes=2) as f:
+            list(f(range(8)))
+
+        self.assertEqual(sorted(self.cache.values()), [x * 2 for x in range(8)])
+
+
+class DiskCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.path = os.path.join(self.dirname, "cache.db")
+        self.cache = caches.DiskCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_get_put(self):
+        self.cache["a"] = [1, 2]
+        self.cache[("b", 1)] = 2
+
+        self.assertEqual(self.cache["a"], [1, 2])
+        self.assertEqual(self.cache[("b", 1)], 2)
+        self.assertRaises(KeyError, self.cache.get, "c")
+
+    def test_persistent(self):
+        """Test that values survive reopening the cache."""
+        self.cache["a"] = 1
+        self.assertEqual(caches.DiskCache(self.path)["a"], 1)
+
+    def test_max_bytes(self):
+        """Test that the oldest items are evicted to stay under max_bytes."""
+        cache = caches.DiskCache(self.path, max_bytes=2500)
+
+        for key in range(5):
+            cache[key] = "x" * 1000
+            time.sleep(0.01)
+
+        self.assertEqual(sorted(cache.keys()), [3, 4])
+
+        cache[4] = "x"  # Replacing an item frees its old size.
+        cache[5] = "x" * 1000
+        self.assertEqual(sorted(cache.keys()), [3, 4, 5])
+
+    def test_too_large(self):
+        """Test that a value larger than max_bytes removes the old value."""
+        cache = caches.DiskCache(self.path, max_bytes=100)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache.put_many([("a", "x" * 1000)])
+
+        self.assertRaises(KeyError, cache.get, "a")
+        self.assertEqual(cache["b"], 2)
+
+        other = caches.DiskCache(os.path.join(self.dirname, "other.db"))
+        other["b"] = "x" * 1000
+        other.dump(self.path + ".dump")
+        cache.load(self.path + ".dump")
+        self.assertRaises(KeyError, cache.get, "b")
+
+        size = cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        total = cache._conn.execute("SELECT bytes FROM meta WHERE id = 0").fetchone()[0]
+        self.assertEqual(total, size)
+
+    def test_dump_load(self):
+        """Test that a dump spanning several batches keeps the LRU order."""
+        self.cache.put_many((key, key * 2) for key in range(2500))
+        time.sleep(0.01)
+        self.cache["last"] = 1
+        self.cache.dump(self.path + ".dump")
+
+        cache = caches.DiskCache(os.path.join(self.dirname, "other.db"))
+        cache.load(self.path + ".dump")
+
+        self.assertEqual(len(cache), 2501)
+        self.assertEqual(cache[1234], 2468)
+        self.assertEqual(cache.keys()[0], "last")
+
+    def test_many(self):
+        self.cache.put_many((key, key * 2) for key in range(1000))
+        found = self.cache.get_many(range(990, 1010))
+
+        self.assertEqual(found, dict((key, key * 2) for key in range(990, 1000)))
+
+    def test_shared_with_workers(self):
+        """Test that values written by workers are visible to the parent."""
+        func = functools.partial(write_cache, self.cache)
+
+        with distributed(func, processes=4) as f:
+            list(f(range(100)))
+
+        self.assertEqual(sorted(self.cache.values()), [x * 2 for x in range(100)])
+
+
+class TieredCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.l2 = caches.SharedMemoryCache(slots=16)
+        self.cache = caches.TieredCache(self.l2, size=2)
+
+    def test_write_through(self):
+        self.cache["a"] = 1
+        self.assertEqual(self.l2["a"], 1)
+
+    def test_stats(self):
+        """Test the per-tier hit counters."""
+        self.l2["a"] = 1
+        self.cache.get("a")  # l2 hit
+        self.cache.get("a")  # l1 hit
+        self.assertRaises(KeyError, self.cache.get, "b")  # miss
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["l1"]["hits"], 1)
+        self.assertEqual(stats["l1"]["misses"], 2)
+        self.assertEqual(stats["l2"]["hits"], 1)
+        self.assertEqual(stats["l2"]["misses"], 1)
+        self.assertEqual(stats["l2"]["hit_rate"], 0.5)
+
+    def test_many(self):
+        self.l2["a"] = 1
+        self.cache.put_many([("b", 2)])
+
+        self.assertEqual(self.cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["l1"]["hits"], 1)
+        self.assertEqual(stats["l2"]["hits"], 1)
+        self.assertEqual(stats["l2"]["misses"], 1)
+
+    def test_l1_ttl(self):
+        """Test that L1 items expire with the L2 cache's ttl."""
+        cache = caches.TieredCache(caches.LRUCache(ttl=0.2))
+        cache["a"] = 1
+        self.assertEqual(cache["a"], 1)
+
+        time.sleep(0.3)
+        self.assertRaises(KeyError, cache.get, "a")
+
+    def test_l1_eviction(self):
+        """Test that L1 evictions fall back to the L2 cache."""
+        for key in "abc":
+            self.cache[key] = key
+
+        self.assertEqual(self.cache["a"], "a")
+        self.assertEqual(self.cache.stats()["l2"]["hits"], 1)
+
+
+class SameRepr(object):
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return "SameRepr()"
+
+
+class MemoizeTests(unittest.TestCase):
+    def test_hashkey(self):
+        """Test that hashkey() produces fixed-size keys that keep distinct
+        inputs apart.
+        """
+        keys = [
+            caches.hashkey((1,), {}),
+            caches.hashkey(("1",), {}),
+            caches.hashkey((1.0,), {}),
+            caches.hashkey(([1],), {}),
+            caches.hashkey((1,), {"x": 1}),
+            caches.hashkey((SameRepr(1),), {}),
+            caches.hashkey((SameRepr(2),), {}),
+            caches.hashkey(("x" * 10000,), {}),
+        ]
+
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(set(len(k) for k in keys), set([20]))
+        self.assertEqual(caches.hashkey((1, "a"), {"b": [2]}),
+                         caches.hashkey((1, "a"), {"b": [2]}))
+
+    def test_hashkey_unpicklable(self):
+        """Test that inputs which can't be pickled aren't keyed on their
+        repr, which other objects can share.
+        """
+        self.assertRaises(TypeError, caches.hashkey, (threading.Lock(),), {})
+        self.assertRaises(TypeError, caches.hashkey, (lambda: None,), {})
+
+    def test_memoize(self):
+        """Test that memoized functions are only called once per input."""
+        calls = []
+
+        @caches.memoize(caches.SharedMemoryCache(slots=16))
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        results = [double(x) for x in [1, 2, 1, 2, 3]]
+
+        self.assertEqual(results, [2, 4, 2, 4, 6])
+        self.assertEqual(calls, [1, 2, 3])
+
+    def test_memoize_batched(self):
+        """Test that batched memoization only computes missing items."""
+        calls = []
+
+        @caches.memoize(caches.LRUCache(), batched=True)
+        def double(items, factor=2):
+            calls.append(list(items))
+            return [x * factor for x in items]
+
+        self.assertEqual(double([1, 2]), [2, 4])
+        self.assertEqual(double([2, 3, 3, 1]), [4, 6, 6, 2])
+        self.assertEqual(double([1], factor=3), [3])
+        self.assertEqual(calls, [[1, 2], [3], [1]])
+
+    def test_memoize_keyfunc(self):
+        """Test that a custom key function is used."""
+        cache = caches.SharedMemoryCache(slots=16)
+
+        @caches.memoize(cache, key=caches.reprkey)
+        def double(x):
+            return x * 2
+
+        double(1)
+        self.assertEqual(cache.keys(), [caches.reprkey((1,), {})])
+
+
+if __name__ == "__main__":
+    unittest.main()
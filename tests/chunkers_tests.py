@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import logging
+import unittest
+
+from buckshot import tasks
+from buckshot import chunkers
+
+LOG = logging.getLogger(__name__)
+
+
+def make_chunk(count, elapsed, transit=0.0):
+    results = [tasks.Result(x, x) for x in range(count)]
+    return tasks.ResultChunk(results, elapsed=elapsed, transit=transit)
+
+
+class AdaptiveChunkerTests(unittest.TestCase):
+    def test_grows_for_fast_tasks(self):
+        """Test that the chunk size grows gradually for fast tasks."""
+        chunker = chunkers.AdaptiveChunker(target=0.1, max_size=64)
+
+        sizes = []
+        for _ in range(10):
+            chunker.update(make_chunk(chunker.size, elapsed=chunker.size * 0.0001))
+            sizes.append(chunker.size)
+
+        self.assertEqual(sizes[:3], [2, 4, 8])
+        self.assertEqual(sizes[-1], 64)
+
+    def test_shrinks_for_slow_tasks(self):
+        """Test that the chunk size drops when tasks become slow."""
+        chunker = chunkers.AdaptiveChunker(target=0.1, smoothing=1.0)
+        chunker.size = 100
+
+        chunker.update(make_chunk(10, elapsed=10.0))
+        self.assertEqual(chunker.size, 1)
+
+    def test_high_transit_raises_target(self):
+        """Test that expensive IPC results in larger chunks."""
+        fast = chunkers.AdaptiveChunker(target=0.01, smoothing=1.0)
+        slow = chunkers.AdaptiveChunker(target=0.01, smoothing=1.0)
+        fast.size = slow.size = 1000
+
+        fast.update(make_chunk(10, elapsed=0.01, transit=0.0))
+        slow.update(make_chunk(10, elapsed=0.01, transit=0.01))
+        self.assertTrue(slow.size > fast.size)
+
+    def test_get_chunker(self):
+        self.assertTrue(isinstance(chunkers.get_chunker("auto"), chunkers.AdaptiveChunker))
+        self.assertEqual(chunkers.get_chunker(5).size, 5)
+        self.assertRaises(ValueError, chunkers.get_chunker, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
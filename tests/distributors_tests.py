@@ -0,0 +1,557 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import glob
+import time
+import shutil
+import tempfile
+import uuid
+import logging
+import unittest
+import functools
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from buckshot import pools
+from buckshot import sharedarrays
+from buckshot import errors
+from buckshot import distributed
+from buckshot import get_context
+
+LOG = logging.getLogger(__name__)
+
+
+def square(x):
+    return x ** 2
+
+
+def sleep_and_return(x):
+    time.sleep(x)
+    return x
+
+
+def reciprocal(x):
+    return 1.0 / x
+
+
+def double(array):
+    return array * 2
+
+
+def sleep_then_len(data, seconds):
+    time.sleep(seconds)
+    return len(data)
+
+
+def identity(x):
+    return x
+
+
+_state = {}
+
+
+def load_state(value):
+    _state["value"] = value
+
+
+def read_state(x):
+    return _state["value"] + x
+
+
+def write_pid(dirname):
+    open(os.path.join(dirname, unicode(os.getpid())), "w").close()
+
+
+def lookup(key):
+    return get_context()[key]
+
+
+def timestamp(x):
+    return time.time()
+
+
+def stall_first(x):
+    if x == 0:
+        time.sleep(0.3)
+    return time.time()
+
+
+def keyed_pid(key, x):
+    time.sleep(0.01)
+    return key, os.getpid()
+
+
+def first(key, x):
+    return key
+
+
+def kind(x):
+    return type(x).__name__
+
+
+def listing(x):
+    return [x]
+
+
+def tag(x):
+    """Return `x` with a value which is unique to this call."""
+    return x, uuid.uuid4().hex
+
+
+class DistributedTests(unittest.TestCase):
+    def test_ordered_chunks(self):
+        """Test that chunked results are returned in input order."""
+        values = range(100)
+
+        with distributed(square, processes=2, chunksize=7) as f:
+            results = list(f(values))
+
+        self.assertEqual(results, [square(x) for x in values])
+
+    def test_unordered_chunks(self):
+        """Test that chunked unordered results contain every input."""
+        values = range(100)
+
+        with distributed(square, processes=2, ordered=False, chunksize=7) as f:
+            results = list(f(values))
+
+        self.assertEqual(sorted(results), [square(x) for x in values])
+
+    def test_chunk_timeout(self):
+        """Test that a timeout in a chunk only affects the timed out task
+        and the rest of the chunk is still processed.
+        """
+        values = [0, 5, 0, 0]
+
+        with distributed(sleep_and_return, processes=1, timeout=0.5, chunksize=4) as f:
+            results = list(f(values))
+
+        self.assertEqual(len(results), len(values))
+        self.assertTrue(isinstance(results[1], errors.TaskTimeout))
+        self.assertEqual([results[0]] + results[2:], [0, 0, 0])
+
+    def test_auto_chunks(self):
+        """Test that adaptive chunk sizing returns every result in order."""
+        values = range(500)
+
+        with distributed(square, processes=2, chunksize="auto") as f:
+            results = list(f(values))
+
+        self.assertEqual(results, [square(x) for x in values])
+
+    def test_auto_chunks_slow_consumer(self):
+        """Test that results waiting for a slow caller aren't counted as
+        IPC time, which would grow the chunks without bound.
+        """
+        with distributed(sleep_and_return, processes=2, chunksize="auto") as f:
+            for _ in f([0.001] * 200):
+                time.sleep(0.005)
+            size = f._distributor._chunker.size
+
+        self.assertTrue(size < 500, size)
+
+    def test_exception(self):
+        """Test that an exception in the work function is returned as a
+        SubprocessError and the remaining tasks still complete.
+        """
+        with distributed(reciprocal, processes=1, chunksize=2) as f:
+            results = list(f([1, 0, 2]))
+
+        self.assertEqual(results[0], 1.0)
+        self.assertTrue(isinstance(results[1], errors.SubprocessError))
+        self.assertEqual(results[2], 0.5)
+
+    def test_dedupe(self):
+        """Test that duplicate inputs are only processed once and every
+        position gets a result.
+        """
+        values = [1, 2, 1, 3, 2, 1] * 10
+
+        with distributed(tag, processes=2, chunksize=2, dedupe=True) as f:
+            results = list(f(values))
+
+        self.assertEqual([x for x, _ in results], values)
+        self.assertEqual(len(set(results)), 3)
+
+    def test_dedupe_types(self):
+        """Test that equal inputs of different types aren't deduplicated."""
+        values = [(1,), (1.0,), (True,), (2,), (b"a",), ("a",)]
+
+        with distributed(kind, processes=2, dedupe=True) as f:
+            results = list(f(values))
+
+        self.assertEqual(results, ["int", "float", "bool", "int", "str", "unicode"])
+
+    def test_dedupe_copies(self):
+        """Test that duplicate inputs get their own copy of the result."""
+        with distributed(listing, processes=1, chunksize=4, dedupe=True) as f:
+            results = list(f([1, 1, 1, 1]))
+
+        results[0].append(2)
+        self.assertEqual(results[1:], [[1], [1], [1]])
+
+    def test_dedupe_infinite(self):
+        """Test that repeated inputs from an endless generator are read a
+        bounded number at a time.
+        """
+        with distributed(square, processes=2, dedupe=True) as f:
+            results = f(itertools.cycle([1, 2, 3, 4]))
+            first = list(itertools.islice(results, 20))
+            in_progress = len(f._distributor._tasks_in_progress)
+            results.close()
+
+        self.assertEqual(first, [square(x) for x in [1, 2, 3, 4] * 5])
+        self.assertTrue(in_progress < 20, in_progress)
+
+    def test_dedupe_unordered(self):
+        values = [1, 2, 1, 3, 2, 1] * 10
+
+        with distributed(square, processes=2, ordered=False, dedupe=0) as f:
+            results = list(f(values))
+
+        self.assertEqual(sorted(results), sorted(square(x) for x in values))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_shared_arrays(self):
+        """Test that large array inputs and results are passed through
+        shared memory and the shared files are removed.
+        """
+        arrays = [numpy.arange(100000) + x for x in range(4)]
+        arrays.append(numpy.asfortranarray(numpy.ones((300, 200))))
+        arrays.append(numpy.arange(10))  # Under the threshold.
+
+        with distributed(double, processes=2, share_threshold=1024) as f:
+            owner = f._distributor._share_owner
+            results = list(f([(a,) for a in arrays]))
+            leftover = glob.glob(sharedarrays._prefix(owner) + "*")
+
+        self.assertEqual(leftover, [])
+        for array, result in zip(arrays, results):
+            self.assertTrue(numpy.array_equal(result, array * 2))
+            self.assertEqual(type(result), numpy.ndarray)
+
+        self.assertTrue(results[-2].flags.f_contiguous)
+        results[0][0] = -1  # Shared results are writable.
+
+        # Structured arrays keep their field names and types.
+        records = numpy.zeros(1000, dtype=[(b"a", b"f8"), (b"b", b"i4")])
+        records["a"] = numpy.arange(1000) * 0.5
+        records["b"] = numpy.arange(1000)
+
+        with distributed(identity, processes=1, share_threshold=1024) as f:
+            result, = list(f([(records,)]))
+
+        self.assertEqual(result.dtype, records.dtype)
+        self.assertTrue(numpy.array_equal(result, records))
+
+    def test_context(self):
+        """Test that workers can read the context object."""
+        table = dict((x, x * 3) for x in range(100))
+
+        with distributed(lookup, processes=2, chunksize=5, context=table) as f:
+            results = list(f(range(100)))
+
+        self.assertEqual(results, [table[x] for x in range(100)])
+        self.assertEqual(get_context(), None)
+
+    def test_initializer(self):
+        """Test that each worker runs the initializer once before any tasks
+        and that its run time is recorded.
+        """
+        with distributed(read_state, processes=2, initializer=load_state, initargs=(10,)) as f:
+            results = list(f(range(10)))
+            init_times = f._distributor.init_times
+            pids = set(f._distributor._processes)
+
+        self.assertEqual(results, [x + 10 for x in range(10)])
+        self.assertTrue(init_times)
+        self.assertTrue(set(init_times) <= pids)
+        self.assertTrue(all(t >= 0 for t in init_times.values()))
+
+    def test_initializer_error(self):
+        with distributed(read_state, processes=1, initializer=reciprocal, initargs=(0,)) as f:
+            self.assertRaises(RuntimeError, list, f(range(3)))
+
+    def test_teardown(self):
+        """Test that every worker runs its teardown when stopped."""
+        dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirname)
+
+        with distributed(square, processes=2, teardown=functools.partial(write_pid, dirname)) as f:
+            list(f(range(10)))
+            pids = set(unicode(pid) for pid in f._distributor._processes)
+
+        self.assertEqual(set(os.listdir(dirname)), pids)
+
+    def test_readahead(self):
+        """Test that tasks keep running while the caller is busy."""
+        with distributed(timestamp, processes=1, readahead=8) as f:
+            results = f(range(8))
+            next(results)
+            time.sleep(0.3)  # A slow consumer.
+            resumed = time.time()
+            finished = list(results)
+
+        self.assertEqual(len(finished), 7)
+        self.assertTrue(all(t < resumed for t in finished))
+
+    def test_readahead_abandoned(self):
+        """Test that the caller can stop iterating early without waiting
+        for the tasks which are still running.
+        """
+        with distributed(sleep_and_return, processes=2, readahead=2) as f:
+            results = f([0, 3, 3, 3])
+            self.assertEqual(next(results), 0)
+
+            start = time.time()
+            results.close()
+            self.assertTrue(time.time() - start < 1, time.time() - start)
+
+    def test_prefetch(self):
+        values = range(100)
+
+        with distributed(square, processes=2, prefetch=4) as f:
+            self.assertEqual(f._distributor._transport._tasks._maxsize, 8)
+            results = list(f(values))
+
+        self.assertEqual(results, [square(x) for x in values])
+
+    def test_reorder_window(self):
+        """Test that no new tasks are started while the reorder window is
+        full behind a slow task.
+        """
+        with distributed(stall_first, processes=2, reorder_window=5) as f:
+            results = list(f(range(40)))
+
+        # Five buffered results, plus the results and tasks which were
+        # already in the queues when the window filled up, can finish
+        # before the slow task.
+        self.assertEqual(len(results), 40)
+        self.assertTrue(all(t > results[0] for t in results[20:]))
+
+    def test_invalid_chunksize(self):
+        self.assertRaises(ValueError, distributed, square, chunksize=0)
+
+    def test_invalid_prefetch(self):
+        self.assertRaises(ValueError, distributed, square, prefetch=0)
+
+
+class PipeTransportTests(unittest.TestCase):
+    def test_ordered(self):
+        values = range(200)
+
+        with distributed(square, processes=3, chunksize=3, transport="pipe") as f:
+            results = list(f(values))
+
+        self.assertEqual(results, [square(x) for x in values])
+
+    def test_unordered(self):
+        values = range(200)
+
+        with distributed(square, processes=3, ordered=False, transport="pipe") as f:
+            results = list(f(values))
+
+        self.assertEqual(sorted(results), [square(x) for x in values])
+
+    def test_large_messages(self):
+        """Test that large chunks and results which don't fit in the pipe
+        buffers don't deadlock when several chunks are outstanding.
+        """
+        values = [("x" * 500000,)] * 12
+
+        with distributed(double, processes=2, prefetch=3, transport="pipe") as f:
+            results = list(f(values))
+
+        self.assertEqual(results, [x * 2 for x, in values])
+
+    def test_large_chunk_to_busy_worker(self):
+        """Test that sending a large chunk to a busy worker doesn't stop
+        other workers from getting tasks.
+        """
+        data = "x" * 2000000
+        values = [(data, 2)] + [(data, 0)] * 19
+
+        with distributed(sleep_then_len, processes=2, ordered=False, prefetch=2,
+                         transport="pipe") as f:
+            start = time.time()
+            results = f(values)
+            # One fast chunk is prefetched by the busy worker and waits.
+            fast = [next(results) for _ in range(18)]
+            elapsed = time.time() - start
+            list(results)
+
+        self.assertEqual(fast, [len(data)] * 18)
+        self.assertTrue(elapsed < 1.5, elapsed)
+
+    def test_timeout(self):
+        """Test that a worker started after a timeout takes over the slot
+        and the chunks already sent to it.
+        """
+        values = [0, 5, 0, 0, 0, 0]
+
+        with distributed(sleep_and_return, processes=2, timeout=0.5, prefetch=2,
+                         transport="pipe") as f:
+            results = list(f(values))
+            slots = sorted(f._distributor._slots.values())
+
+        self.assertTrue(isinstance(results[1], errors.TaskTimeout))
+        self.assertEqual([results[0]] + results[2:], [0] * 5)
+        self.assertEqual(slots, [0, 1])
+
+    def test_teardown(self):
+        dirname = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirname)
+        teardown = functools.partial(write_pid, dirname)
+
+        with distributed(square, processes=2, teardown=teardown, transport="pipe") as f:
+            list(f(range(10)))
+            pids = set(unicode(pid) for pid in f._distributor._processes)
+
+        self.assertEqual(set(os.listdir(dirname)), pids)
+
+    def test_invalid_transport(self):
+        self.assertRaises(ValueError, distributed, square, transport="carrier pigeon")
+
+
+class ScheduleTests(unittest.TestCase):
+    def test_schedules(self):
+        """Test that every schedule returns every result in order."""
+        values = range(200)
+
+        for schedule in ("round-robin", "least-outstanding", "work-stealing"):
+            with distributed(square, processes=3, chunksize=4, prefetch=2, schedule=schedule) as f:
+                results = list(f(values))
+
+            self.assertEqual(results, [square(x) for x in values], schedule)
+
+    def test_skewed(self):
+        """Test that a worker stuck on a slow task isn't left holding the
+        tasks it was dealt.
+        """
+        values = [1.0] + [0.05] * 20
+
+        with distributed(sleep_and_return, processes=2, ordered=False, prefetch=2,
+                         schedule="work-stealing") as f:
+            start = time.time()
+            results = list(f(values))
+            elapsed = time.time() - start
+
+        self.assertEqual(sorted(results), sorted(values))
+        self.assertTrue(elapsed < 1.3, elapsed)
+
+    def test_timeout(self):
+        values = [0, 5, 0, 0, 0, 0]
+
+        with distributed(sleep_and_return, processes=2, timeout=0.5, chunksize=2,
+                         schedule="least-outstanding") as f:
+            results = list(f(values))
+
+        self.assertTrue(isinstance(results[1], errors.TaskTimeout))
+        self.assertEqual([results[0]] + results[2:], [0] * 5)
+
+    def test_invalid_schedule(self):
+        self.assertRaises(ValueError, distributed, square, schedule="lottery")
+
+    def test_queue_transport(self):
+        self.assertRaises(ValueError, distributed, square, schedule="round-robin",
+                          transport="queue")
+
+
+class AffinityTests(unittest.TestCase):
+    def test_affinity(self):
+        """Test that tasks with the same key mostly run in the same worker
+        and every result is returned in order.
+        """
+        values = [(key, x) for x in range(30) for key in (0, 1)]
+
+        with distributed(keyed_pid, processes=2, affinity=first) as f:
+            results = list(f(values))
+
+        self.assertEqual([key for key, _ in results], [key for key, _ in values])
+
+        owners = []
+        for key in (0, 1):
+            pids = [pid for k, pid in results if k == key]
+            owner = max(set(pids), key=pids.count)
+            self.assertTrue(pids.count(owner) > 20, pids)
+            owners.append(owner)
+
+        self.assertNotEqual(owners[0], owners[1])
+
+    def test_overflow(self):
+        """Test that an idle worker takes tasks from a busy worker which
+        is backed up with tasks for one key.
+        """
+        values = [(0, x) for x in range(10)]
+
+        with distributed(keyed_pid, processes=2, affinity=first) as f:
+            results = list(f(values))
+
+        self.assertEqual(len(set(pid for _, pid in results)), 2)
+
+    def test_schedule(self):
+        self.assertRaises(ValueError, distributed, square, affinity=first,
+                          schedule="round-robin")
+
+
+class DistributorPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = pools.DistributorPool(idle_timeout=None)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_reuse(self):
+        """Test that pooled worker processes are reused across calls."""
+        with distributed(square, processes=2, pool=self.pool) as f:
+            first = list(f(range(10)))
+            pids = set(f._distributor._processes)
+
+        with distributed(square, processes=2, pool=self.pool) as f:
+            second = list(f(range(10)))
+            self.assertEqual(set(f._distributor._processes), pids)
+
+        self.assertEqual(first, second)
+
+    def test_unfinished_not_reused(self):
+        """Test that a distributor with unreturned results is stopped rather
+        than returned to the pool.
+        """
+        with distributed(sleep_and_return, processes=1, pool=self.pool) as f:
+            results = f([0, 0.1, 0.1])
+            next(results)
+            distributor = f._distributor
+
+        self.assertFalse(distributor.is_started)
+
+    def test_context_key(self):
+        """Test that pooled distributors are only reused for the same
+        context object.
+        """
+        first, second = {"a": 1}, {"a": 2}
+
+        with distributed(lookup, processes=1, context=first, pool=self.pool) as f:
+            self.assertEqual(list(f(["a"])), [1])
+
+        with distributed(lookup, processes=1, context=second, pool=self.pool) as f:
+            self.assertEqual(list(f(["a"])), [2])
+
+    def test_idle_timeout(self):
+        """Test that idle distributors are stopped after the idle timeout."""
+        pool = pools.DistributorPool(idle_timeout=0.1)
+
+        with distributed(square, processes=1, pool=pool) as f:
+            list(f(range(3)))
+            distributor = f._distributor
+
+        time.sleep(0.5)
+        self.assertFalse(distributor.is_started)
+
+
+if __name__ == "__main__":
+    unittest.main()
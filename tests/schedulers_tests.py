@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import Queue
+import logging
+import unittest
+
+from buckshot import tasks
+from buckshot import schedulers
+
+LOG = logging.getLogger(__name__)
+
+
+class FakeTransport(object):
+    def __init__(self, busy=()):
+        self.busy = set(busy)
+
+    def is_free(self, slot):
+        return slot not in self.busy
+
+
+class RoundRobinSchedulerTests(unittest.TestCase):
+    def test_skips_busy(self):
+        scheduler = schedulers.RoundRobinScheduler(3)
+        transport = FakeTransport(busy=[1])
+
+        slots = [scheduler.next_slot(transport) for _ in range(4)]
+        self.assertEqual(slots, [0, 2, 0, 2])
+
+    def test_full(self):
+        scheduler = schedulers.RoundRobinScheduler(2)
+        self.assertRaises(Queue.Full, scheduler.next_slot, FakeTransport(busy=[0, 1]))
+
+
+class LeastOutstandingSchedulerTests(unittest.TestCase):
+    def test_least_outstanding(self):
+        scheduler = schedulers.LeastOutstandingScheduler(3)
+        scheduler.sent(0, 4)
+        scheduler.sent(1, 2)
+        scheduler.sent(2, 3)
+        self.assertEqual(scheduler.next_slot(FakeTransport()), 1)
+
+        scheduler.done(0, 4)
+        self.assertEqual(scheduler.next_slot(FakeTransport()), 0)
+        self.assertEqual(scheduler.next_slot(FakeTransport(busy=[0])), 1)
+
+
+class WorkStealingSchedulerTests(unittest.TestCase):
+    def test_own_tasks_first(self):
+        scheduler = schedulers.WorkStealingScheduler(2)
+        for task in range(6):
+            scheduler.add(task)
+
+        self.assertEqual(scheduler.take(0, 2), [0, 2])
+        self.assertEqual(scheduler.take(1, 2), [1, 3])
+        self.assertEqual(len(scheduler), 2)
+
+    def test_steal(self):
+        """Test that a slot with no tasks steals from the back of the
+        longest deque.
+        """
+        scheduler = schedulers.WorkStealingScheduler(2)
+        for task in range(6):
+            scheduler.add(task)
+
+        scheduler.take(1, 3)
+        self.assertEqual(scheduler.next_slot(FakeTransport(busy=[0])), 1)
+        self.assertEqual(scheduler.take(1, 2), [2, 4])
+        self.assertEqual(scheduler.take(0, 2), [0])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_requeue(self):
+        scheduler = schedulers.WorkStealingScheduler(2)
+        for task in range(4):
+            scheduler.add(task)
+
+        tasks = scheduler.take(1, 1)
+        scheduler.requeue(tasks, 1)
+        self.assertEqual(scheduler.take(1, 2), [1, 3])
+
+
+class AffinitySchedulerTests(unittest.TestCase):
+    def test_same_key_same_slot(self):
+        scheduler = schedulers.AffinityScheduler(3, key=lambda name, x: name)
+
+        for x in range(4):
+            for name in ("a", "b", "c"):
+                scheduler.add(tasks.Task(len(scheduler), (name, x)))
+
+        slots = {}  # name => slots whose deques hold tasks for it.
+        for slot, deque in enumerate(scheduler._deques):
+            for task in deque:
+                slots.setdefault(task.args[0], set()).add(slot)
+
+        self.assertEqual(sorted(slots), ["a", "b", "c"])
+        self.assertTrue(all(len(s) == 1 for s in slots.values()), slots)
+
+    def test_overflow(self):
+        """Test that a slot with no tasks of its own steals from a busy
+        slot.
+        """
+        scheduler = schedulers.AffinityScheduler(2, key=lambda x: 0)
+        for x in range(4):
+            scheduler.add(tasks.Task(x, (x,)))
+
+        slot = scheduler.next_slot(FakeTransport(busy=[0]))
+        self.assertEqual(slot, 1)
+        self.assertEqual([t.id for t in scheduler.take(slot, 1)], [3])
+
+
+class GetSchedulerTests(unittest.TestCase):
+    def test_default(self):
+        scheduler = schedulers.get_scheduler(None, 2)
+        self.assertTrue(isinstance(scheduler, schedulers.FifoScheduler))
+        self.assertEqual(scheduler.next_slot(FakeTransport()), None)
+
+    def test_affinity(self):
+        scheduler = schedulers.get_scheduler(None, 2, affinity=len)
+        self.assertTrue(isinstance(scheduler, schedulers.AffinityScheduler))
+        self.assertRaises(ValueError, schedulers.get_scheduler, "round-robin", 2, affinity=len)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, schedulers.get_scheduler, "lottery", 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
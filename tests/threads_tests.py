@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import logging
+import unittest
+import threading
+
+from buckshot import threads
+
+LOG = logging.getLogger(__name__)
+
+
+def current_thread_ident(sleep=0):
+    time.sleep(sleep)
+    return threading.current_thread().ident
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def count_then_fail(count):
+    for x in range(count):
+        yield x
+    fail()
+
+
+class ExecutorTests(unittest.TestCase):
+    def test_thread_reused(self):
+        """Test that the same thread runs every call."""
+        executor = threads.Executor(current_thread_ident, daemon=True, timeout=5)
+        idents = set(executor() for _ in range(10))
+
+        self.assertEqual(len(idents), 1)
+        self.assertNotEqual(idents.pop(), threading.current_thread().ident)
+
+    def test_timeout_replaces_thread(self):
+        """Test that a new thread is started after a timeout."""
+        executor = threads.Executor(current_thread_ident, daemon=True, timeout=0.1)
+        first = executor()
+
+        self.assertRaises(threads.ThreadTimeout, executor, 1)
+        self.assertNotEqual(executor(), first)
+
+    def test_exception(self):
+        """Test that exceptions are raised in the caller."""
+        executor = threads.Executor(fail, daemon=True)
+        self.assertRaises(ValueError, executor)
+
+
+class ReadaheadTests(unittest.TestCase):
+    def test_items(self):
+        self.assertEqual(list(threads.readahead(iter(range(100)), 3)), range(100))
+
+    def test_bounded(self):
+        """Test that the producer stays at most `size` items ahead."""
+        produced = []
+
+        def produce():
+            for x in range(100):
+                produced.append(x)
+                yield x
+
+        items = threads.readahead(produce(), 5)
+        next(items)
+        time.sleep(0.2)
+
+        # One item consumed, five buffered, one waiting to be buffered.
+        self.assertTrue(len(produced) <= 7)
+        items.close()
+
+    def test_exception(self):
+        """Test that exceptions are raised in the caller after the items
+        produced before them.
+        """
+        items = threads.readahead(count_then_fail(3), 2)
+
+        self.assertEqual([next(items) for _ in range(3)], [0, 1, 2])
+        self.assertRaises(ValueError, next, items)
+
+
+if __name__ == "__main__":
+    unittest.main()